@@ -1,73 +1,159 @@
 import json
 import argparse
+import contextlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+import streaming
 
 """
-This program is for switching the format of the legal will dataset introduced by Kwak et al. (2023) into the one used by our project. To download the dataset, visit: https://github.com/ml4ai/ie4wills/tree/main/data/raw. To run this program, run the following code: python format_translator.py path/to/your/input_file.json path/to/your/output_path
+This program is for switching the format of the legal will dataset introduced by Kwak et al. (2023) into the one used by our project. To download the dataset, visit: https://github.com/ml4ai/ie4wills/tree/main/data/raw. The export is read one document at a time (the whole array is never loaded), and with `--workers` the documents are converted by a pool of processes while the output files are written in the order of the export. To run this program, run the following code: python format_translator.py path/to/your/input_file.json path/to/your/output_path --workers 4
 """
 
+# documents sent to the workers at a time (two batches are in flight, so memory stays flat for large exports)
+BATCH_SIZE = 1024
+
 def main():
   # get the path to the input file as an argument
   parser = argparse.ArgumentParser(description='Process some data.')
   parser.add_argument('input_file', type=str, help='Path to the input file')
   parser.add_argument('output_path', type=str, help='Path to save the output files')
+  parser.add_argument('--workers', type=int, default=1, help='Number of processes converting the documents in parallel')
   args = parser.parse_args()
   file = args.input_file
   output_path = args.output_path
 
   with open(file) as f:
-    data = json.load(f)
+    for datum_id, json_object, messages in convert_documents(iter_json_array(f), args.workers):
+      # the messages printed while converting the document, in the order of the export
+      print(messages, end='')
+      json_file_name = output_path+"/"+str(datum_id)+".json"
+
+      # Writing to sample.json
+      with open(json_file_name, "w") as outfile:
+        outfile.write(json_object)
+
+# Yields the items of the json array of the file one at a time, reading the file in chunks
+def iter_json_array(f, chunk_size=1 << 20):
+  decoder = json.JSONDecoder()
+  buffer = ''
+  position = 0
+  while position == len(buffer):
+    chunk = f.read(chunk_size)
+    if not chunk:
+      break
+    buffer = chunk
+    position = skip_whitespace(buffer, 0)
+  if buffer[position:position + 1] != '[':
+    raise ValueError("the export is not a json array")
+  position += 1
+  end_of_file = False
+  while True:
+    position = skip_whitespace(buffer, position)
+    # an item is yielded only once the separator after it was read (a number may go on in the next chunk)
+    start = position
+    try:
+      if buffer[position:position + 1] == ']':
+        return
+      if buffer[position:position + 1] == ',':
+        position = skip_whitespace(buffer, position + 1)
+        if buffer[position:position + 1] == ']':
+          raise ValueError("the export is not a json array (a comma before its closing bracket)")
+      item, end = decoder.raw_decode(buffer, position)
+      next_position = skip_whitespace(buffer, end)
+      if buffer[next_position:next_position + 1] in (',', ']'):
+        yield item
+        position = next_position
+        continue
+    except json.JSONDecodeError:
+      if end_of_file:
+        raise
+    if end_of_file:
+      raise ValueError("the export is not a json array (or ends before its closing bracket)")
+    chunk = f.read(chunk_size)
+    end_of_file = not chunk
+    buffer = buffer[start:] + chunk
+    position = 0
+
+def skip_whitespace(buffer, position):
+  return json.decoder.WHITESPACE.match(buffer, position).end()
+
+# Converts the documents, in a pool of processes if workers > 1, and yields (id, json text, printed messages) in order
+def convert_documents(data, workers=1):
+  if workers <= 1:
+    for datum in data:
+      yield convert_document(datum)
+    return
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    pending = None
+    for batch in streaming.chunked(data, BATCH_SIZE):
+      # the next batch is converted while the results of the previous one are written
+      submitted = executor.map(convert_document, batch, chunksize=max(1, len(batch) // (workers * 4)))
+      if pending is not None:
+        yield from pending
+      pending = submitted
+    if pending is not None:
+      yield from pending
+
+def convert_document(datum):
+  messages = io.StringIO()
+  with contextlib.redirect_stdout(messages):
+    result = datum['annotations'][0]['result']
+    items_by_id = index_by_id(result)
 
-  for datum in data:
     # take care of entities
-    entity_dict = get_entity_dictionary(datum['annotations'][0]['result'])
-    id_dict, entity_json_list = switch_entity_to_json(entity_dict, datum['annotations'][0]['result'])
+    entity_dict = get_entity_dictionary(result, items_by_id)
+    id_dict, entity_json_list = switch_entity_to_json(entity_dict, items_by_id)
 
     # take care of events
-    event_list = handling_events(datum['annotations'][0]['result'], id_dict, entity_dict)
+    event_list = handling_events(result, id_dict, entity_dict, items_by_id)
     id_trigger_type, new_event_dict_list = event_to_json_list(event_list)
     event_json_list = change_trigger_to_event(id_trigger_type, new_event_dict_list)
 
-    # make into json format
-    final_json = {"text": datum['data']['text'], "entities": entity_json_list, "events": event_json_list}
+  # make into json format
+  final_json = {"text": datum['data']['text'], "entities": entity_json_list, "events": event_json_list}
 
-    # Serializing json
-    json_object = json.dumps(final_json, indent=4)
-    json_file_name = output_path+"/"+str(datum['id'])+".json"
+  # Serializing json
+  return datum['id'], json.dumps(final_json, indent=4), messages.getvalue()
 
-    # Writing to sample.json
-    with open(json_file_name, "w") as outfile:
-        outfile.write(json_object)
+# id -> the items of the annotation result with this id, in order (built once per document, instead of scanning the result for each id)
+def index_by_id(data):
+  items_by_id = {}
+  for item in data:
+    if item.get('id') is not None:
+      items_by_id.setdefault(item['id'], []).append(item)
+  return items_by_id
 
+# Merges the lists sharing an item. Every list is merged with the groups it overlaps (in the order the groups were made),
+# found through the group of each item instead of comparing it with every group.
 def merge_overlapping_lists(lists):
-    merged = []
-    while lists:
-        current_list = lists.pop(0)
-        i = 0
-        while i < len(merged):
-            if any(item in merged[i] for item in current_list):
-                current_list.extend(merged.pop(i))
-                i = 0  # Start over after merging
-            else:
-                i += 1
-        merged.append(list(set(current_list)))
-    return merged
-
-def count_keys_starting_with_entity(dictionary, entity):
-    count = 0
-    for key in dictionary.keys():
-        if key.startswith(entity):
-            count += 1
-    return count
-
-def id_into_text(entities, data):
+  merged = {}
+  group_of = {}
+  for number, current_list in enumerate(lists):
+    overlapping = sorted({group_of[item] for item in current_list if item in group_of})
+    current_list = list(current_list)
+    for group in overlapping:
+      current_list.extend(merged.pop(group))
+    merged[number] = list(set(current_list))
+    for item in merged[number]:
+      group_of[item] = number
+  return list(merged.values())
+
+def count_keys_starting_with_entity(label_counts, entity):
+  count = 0
+  for label, label_count in label_counts.items():
+    if label.startswith(entity):
+      count += label_count
+  return count
+
+def id_into_text(entities, items_by_id):
   text_entities = []
   for entity in entities:
-    for i in data:
-      if i.get('id') == entity and i['value']['text'].strip() not in text_entities:
+    for i in items_by_id.get(entity, []):
+      if i['value']['text'].strip() not in text_entities:
         text_entities.append(i['value']['text'].strip())
   return text_entities
 
-def get_entity_dictionary(data):
+def get_entity_dictionary(data, items_by_id):
   entire_entities = []
   for item in data:
     if item.get('id'):
@@ -84,15 +170,18 @@ def get_entity_dictionary(data):
 
   # make the list into dictionary by adding the labels for each list
   final_entities = {}
+  # label -> number of entities named after it so far
+  label_counts = {}
   for i in coreference_resolution:
-    for j in data:
-      if j.get('id') == i[0]:
-        count = count_keys_starting_with_entity(final_entities, j['value']['labels'][0])
-        final_entities[j['value']['labels'][0]+str(count+1)] = i
+    for j in items_by_id.get(i[0], []):
+      label = j['value']['labels'][0]
+      count = count_keys_starting_with_entity(label_counts, label)
+      final_entities[label+str(count+1)] = i
+      label_counts[label] = label_counts.get(label, 0) + 1
 
   return final_entities
 
-def switch_entity_to_json(final_entities, data):
+def switch_entity_to_json(final_entities, items_by_id):
   entity_list = []
   id_dict = {}
   for entity in final_entities:
@@ -100,7 +189,7 @@ def switch_entity_to_json(final_entities, data):
       entity_json = {}
       id = "e"+str(len(entity_list)+1)
       entity_json["id"] = id
-      entity_json["texts"] = id_into_text(final_entities[entity], data)
+      entity_json["texts"] = id_into_text(final_entities[entity], items_by_id)
       entity_type = entity.replace("_", " ").lower().title().replace(" ", "")
       final_entity = ''.join([i for i in entity_type if not i.isdigit()])
       entity_json["type"] = final_entity
@@ -109,7 +198,7 @@ def switch_entity_to_json(final_entities, data):
   return id_dict, entity_list
 
 # start handling events
-def handling_events(data, id_dict, entity_dict):
+def handling_events(data, id_dict, entity_dict, items_by_id):
   result_dict = {}
   for datum in data:
     if datum.get('type') == 'relation':
@@ -118,7 +207,7 @@ def handling_events(data, id_dict, entity_dict):
           labels = datum['labels']
           from_id = datum['from_id']
           to_id = datum['to_id']
-          if check_if_event(from_id, data):
+          if check_if_event(from_id, items_by_id):
             for label in labels:
               key = (label, from_id)
               if key not in result_dict:
@@ -127,44 +216,47 @@ def handling_events(data, id_dict, entity_dict):
       else:
         print("no relation label, need to check:", datum)
 
+  # annotation id -> the entities (keys of entity_dict) containing it, and the position of each entity in entity_dict
+  entities_of = {}
+  entity_positions = {}
+  for position, i in enumerate(entity_dict):
+    entity_positions[i] = position
+    for annotation_id in entity_dict[i]:
+      entities_of.setdefault(annotation_id, []).append(i)
+
   # change the format of the dict (merge args by events)
   new_dict_list = []
   for key, value in result_dict.items():
       type_args = {}
-      for i in entity_dict:
-        for v in value:
-          if v in entity_dict[i]:
-            if key not in type_args:
-              type_args[key] = [(i, entity_dict[i])]
-            else:
-              type_args[key].append((i, entity_dict[i]))
-      if type_args != {}:
+      # the entities of the arguments, in the order of entity_dict (once per argument they contain)
+      arg_entities = sorted([i for v in value for i in entities_of.get(v, [])], key=lambda i: entity_positions[i])
+      if arg_entities:
+        type_args[key] = [(i, entity_dict[i]) for i in arg_entities]
         new_dict_list.append(type_args)
 
+  # entity annotation ids -> json id (the last entity with these ids)
+  json_ids = {tuple(ids): id for id, ids in id_dict.items()}
+
   final_list = []
   for event_dict in new_dict_list:
     for i in event_dict:
       new_list = []
       for j in event_dict[i]:
         j = list(j)
-        j[1] = annotation_id_to_json_id(j[1], id_dict)
+        j[1] = annotation_id_to_json_id(j[1], json_ids)
         new_list.append(j)
       event_dict[i] = new_list
     final_list.append(event_dict)
 
   return final_list
 
-def check_if_event(id, data):
-  for datum in data:
-    if datum.get('id') == id:
-      return datum['value']['labels'] == ['TRIGGER']
+def check_if_event(id, items_by_id):
+  items = items_by_id.get(id)
+  if items:
+    return items[0]['value']['labels'] == ['TRIGGER']
 
-def annotation_id_to_json_id(annotation_id_list, id_dict):
-  new_id = annotation_id_list
-  for id in id_dict:
-    if annotation_id_list == id_dict[id]:
-      new_id = id
-  return new_id
+def annotation_id_to_json_id(annotation_id_list, json_ids):
+  return json_ids.get(tuple(annotation_id_list), annotation_id_list)
 
 def event_to_json_list(final_list):
   new_event_dict_list = []
@@ -190,22 +282,26 @@ def event_to_json_list(final_list):
   return id_trigger_type_list, new_event_dict_list
 
 def change_trigger_to_event(id_trigger_type, new_event_dict_list):
+  # trigger annotation id -> (event id, event type) of the events it triggers, in order
+  events_of_trigger = {}
+  for each_dict in id_trigger_type:
+    for i in each_dict:
+      events_of_trigger.setdefault(each_dict[i][0], []).append((i, each_dict[i][1]))
+
   final_event_list = []
   for event_dict in new_event_dict_list:
     new_event_dict = {}
     for k, v in event_dict.items():
       if isinstance(v[0], list):
-        for each_dict in id_trigger_type:
-          for i in each_dict:
-            if v[0][0] == each_dict[i][0]:
-              if each_dict[i][1] not in new_event_dict.keys():
-                new_event_dict[each_dict[i][1]] = [i]
-              else:
-                new_event_dict[each_dict[i][1]].append(i)
+        for i, event_type in events_of_trigger.get(v[0][0], []):
+          if event_type not in new_event_dict.keys():
+            new_event_dict[event_type] = [i]
+          else:
+            new_event_dict[event_type].append(i)
       else:
         new_event_dict[k] = v
     final_event_list.append(new_event_dict)
   return final_event_list
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
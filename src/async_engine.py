@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import time
+from collections import deque
+import batch_classification
+import metrics
+import response_cache
+import scheduler
+from openai import AsyncOpenAI, OpenAI
+
+"""
+This program runs the classification and extraction requests concurrently with asyncio instead of one blocking call at a time. The number of requests in flight adapts to the server's rate limits up to `concurrency` (see `scheduler.py`), and optional requests-per-minute / tokens-per-minute limits keep the run under the account's rate limits. Results always come back in the same order as the input texts. To compare the throughput with the sequential path against a local stand-in server (see `mock_server.py`), run the following code:
+```
+python async_engine.py --base-url http://127.0.0.1:8000/v1 --num-texts 100 --concurrency 16
+```
+"""
+
+
+# The request bodies below are the same as the ones used by the sequential extract_information / classification functions
+def extraction_request(prompt, target_text, model_name):
+    return {
+        "model": model_name,
+        "response_format": {
+            'type': 'json_object',
+        },
+        "messages": [
+            {
+                "role": "system",
+                "content": prompt
+            },
+            {
+                "role": "user",
+                "content": target_text
+            }
+        ],
+        "temperature": 0,
+        "max_tokens": 4096,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0
+    }
+
+
+def classification_request(prompt, target_text):
+    return {
+        "model": "gpt-3.5-turbo-0125",
+        "messages": [
+            {
+                "role": "system",
+                "content": prompt
+            },
+            {
+                "role": "user",
+                "content": target_text
+            }
+        ],
+        "temperature": 0,
+        "max_tokens": 4096,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0
+    }
+
+
+# Rough token estimate (~4 characters per token) for the tokens-per-minute limit. The completion budget (max_tokens) counts against the limit as well.
+def estimate_tokens(request):
+    prompt_chars = sum(len(message["content"]) for message in request["messages"])
+    return prompt_chars // 4 + request.get("max_tokens", 0)
+
+
+# Token bucket limiter for requests per minute (rpm) and tokens per minute (tpm). None means no limit.
+class RateLimiter:
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_budget = float(rpm) if rpm else None
+        self.token_budget = float(tpm) if tpm else None
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        if self.rpm:
+            self.request_budget = min(float(self.rpm), self.request_budget + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.token_budget = min(float(self.tpm), self.token_budget + elapsed * self.tpm / 60)
+
+    def _wait_time(self, tokens):
+        wait = 0
+        if self.rpm and self.request_budget < 1:
+            wait = max(wait, (1 - self.request_budget) * 60 / self.rpm)
+        if self.tpm and self.token_budget < tokens:
+            wait = max(wait, (tokens - self.token_budget) * 60 / self.tpm)
+        return wait
+
+    async def acquire(self, tokens=0):
+        if not self.rpm and not self.tpm:
+            return
+        if self.tpm:
+            # a single request larger than the whole bucket would never fit otherwise
+            tokens = min(tokens, self.tpm)
+        # the lock keeps the waiting requests in arrival order
+        async with self.lock:
+            self._refill()
+            wait = self._wait_time(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+                wait = self._wait_time(tokens)
+            if self.rpm:
+                self.request_budget -= 1
+            if self.tpm:
+                self.token_budget -= tokens
+
+
+class AsyncEngine:
+    def __init__(self, client, concurrency=8, rpm=None, tpm=None, stage="extract"):
+        self.client = client
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rpm, tpm)
+        # the number of requests in flight adapts to the server's rate limits, up to concurrency (see scheduler.py)
+        self.scheduler = scheduler.shared
+        self.scheduler.set_concurrency(concurrency)
+        self.gate = scheduler.AsyncGate(self.scheduler)
+        # the stage the requests are recorded under (see metrics.py)
+        self.stage = stage
+
+    async def complete(self, request, return_exceptions=False, index=None):
+        stats = {}
+        cached = metrics.is_cached(self.client, request)
+
+        # responses answered from the response cache don't count against the rate limits
+        async def wait_for_limits():
+            if not cached:
+                start = time.perf_counter()
+                await self.limiter.acquire(estimate_tokens(request))
+                stats["queue_wait"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            response = await self.scheduler.send_async(self.client.chat.completions.create, request, self.gate, stats, wait_for_limits)
+        except Exception as e:
+            metrics.record_call(self.stage, request, stats, time.perf_counter() - start, cached=cached, error=type(e).__name__, index=index)
+            if return_exceptions:
+                return e
+            raise
+        metrics.record_call(self.stage, request, stats, time.perf_counter() - start, response.usage, cached, index=index)
+        return response.choices[0].message.content
+
+    # Yields the response contents in input order. Requests are pulled lazily from the iterable and at most
+    # 2 * concurrency of them are scheduled at a time, so memory stays bounded for long inputs.
+    # With return_exceptions, a failed request yields its exception instead of stopping the iteration.
+    # With indexed, the requests are (index, request) pairs and the index is recorded with the metrics of the request.
+    async def imap(self, requests, return_exceptions=False, indexed=False):
+        pending = deque()
+        try:
+            for request in requests:
+                index, request = request if indexed else (None, request)
+                pending.append(asyncio.ensure_future(self.complete(request, return_exceptions, index)))
+                if len(pending) >= 2 * self.concurrency:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def map(self, requests, return_exceptions=False):
+        return [content async for content in self.imap(requests, return_exceptions)]
+
+
+# The retries are left to the scheduler, which sees the rate limits of every request (see scheduler.py)
+def make_async_client(api_key, base_url=None, cache=None):
+    return response_cache.wrap_async_client(AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0), cache)
+
+
+# Runs the requests through a fresh engine and returns the contents in input order. With return_exceptions, a
+# failed request gets its exception instead of its content.
+def run_requests(requests, api_key, concurrency=8, rpm=None, tpm=None, base_url=None, cache=None, stage="extract", return_exceptions=False):
+    async def run():
+        client = make_async_client(api_key, base_url, cache)
+        engine = AsyncEngine(client, concurrency, rpm, tpm, stage)
+        try:
+            return await engine.map(requests, return_exceptions)
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def classify_text_list(text_list, prompt, api_key, concurrency=8, rpm=None, tpm=None, base_url=None, cache=None, batch_size=1, return_exceptions=False):
+    if batch_size > 1:
+        return classify_in_batches(text_list, prompt, api_key, concurrency, rpm, tpm, base_url, cache, batch_size, return_exceptions)
+    requests = (classification_request(prompt, text) for text in text_list)
+    contents = run_requests(requests, api_key, concurrency, rpm, tpm, base_url, cache, "classify", return_exceptions)
+    total_classifications = [content if isinstance(content, Exception) else eval(content) for content in contents]
+    assert len(text_list) == len(total_classifications)
+    return total_classifications
+
+
+# Sends batch_size texts per request. The texts of batches whose output can't be parsed (or whose request failed) are classified again one at a time.
+def classify_in_batches(text_list, prompt, api_key, concurrency=8, rpm=None, tpm=None, base_url=None, cache=None, batch_size=20, return_exceptions=False):
+    batches = batch_classification.make_batches(text_list, batch_size)
+    requests = (batch_classification.batch_classification_request(prompt, text_batch) for text_batch in batches)
+    contents = run_requests(requests, api_key, concurrency, rpm, tpm, base_url, cache, "classify_batch", return_exceptions)
+    total_classifications = []
+    retry_rows = []
+    for text_batch, content in zip(batches, contents):
+        labels = batch_classification.parse_batch_response(content, len(text_batch)) if not isinstance(content, Exception) else None
+        if labels is None:
+            retry_rows += range(len(total_classifications), len(total_classifications) + len(text_batch))
+            labels = [None] * len(text_batch)
+        total_classifications += labels
+    if retry_rows:
+        print(str(len(retry_rows)) + " texts are in batches that could not be parsed, classifying them one by one")
+        retry_preds = classify_text_list([text_list[n] for n in retry_rows], prompt, api_key, concurrency, rpm, tpm, base_url, cache, return_exceptions=return_exceptions)
+        for n, labels in zip(retry_rows, retry_preds):
+            total_classifications[n] = labels
+    assert len(text_list) == len(total_classifications)
+    return total_classifications
+
+
+# Runs (index, request) pairs, which may come from a lazy iterable. Like run_requests, but stops at the first
+# failed request and returns the contents received before it. With a writer (see result_writer.py), each content
+# is saved under its index as soon as it arrives, failed requests are skipped, and the number of saved results is returned instead.
+def extract_text_list(indexed_requests, api_key, concurrency=8, rpm=None, tpm=None, base_url=None, cache=None, writer=None):
+    # the engine yields the contents in request order, so the indices are queued as the requests are pulled
+    indices = deque()
+
+    def requests():
+        for n, request in indexed_requests:
+            indices.append(n)
+            yield n, request
+
+    async def run():
+        client = make_async_client(api_key, base_url, cache)
+        engine = AsyncEngine(client, concurrency, rpm, tpm, "extract")
+        extracted_info = []
+        try:
+            async for content in engine.imap(requests(), return_exceptions=writer is not None, indexed=True):
+                n = indices.popleft()
+                if writer is None:
+                    extracted_info.append(content)
+                elif isinstance(content, Exception):
+                    print("something went wrong while processing " + str(n) + "th text!")
+                    writer.fail(n, "extract", content)
+                    continue
+                else:
+                    writer.write(n, content)
+                print("processed " + str(n+1) + "th sentence!")
+        except Exception:
+            print("something went wrong while processing " + str(len(extracted_info)) + "th text!")
+        finally:
+            await client.close()
+        if writer is not None:
+            return writer.written
+        return extracted_info
+    return asyncio.run(run())
+
+
+def report_throughput(num_texts, elapsed, label="extraction"):
+    rate = num_texts / elapsed if elapsed > 0 else 0
+    print(f"{label}: {num_texts} texts in {elapsed:.2f}s ({rate:.2f} texts/sec)")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the sequential and the concurrent extraction throughput against an OpenAI-compatible server')
+    parser.add_argument('--base-url', type=str, default='http://127.0.0.1:8000/v1', help='Base url of the (stand-in) server')
+    parser.add_argument('--api-key', type=str, default='test', help='API key sent to the server')
+    parser.add_argument('--model', type=str, default='gpt-4o-mini-2024-07-18', help='Model name sent to the server')
+    parser.add_argument('--num-texts', type=int, default=50, help='Number of texts to send')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum number of requests in flight')
+    parser.add_argument('--rpm', type=int, default=None, help='Requests per minute limit')
+    parser.add_argument('--tpm', type=int, default=None, help='Tokens per minute limit')
+    args = parser.parse_args()
+
+    texts = ["I give all my property to [Person-" + str(n) + "]." for n in range(args.num_texts)]
+    requests = [extraction_request("Extract the entities and events.", text, args.model) for text in texts]
+
+    client = OpenAI(api_key=args.api_key, base_url=args.base_url)
+    start = time.perf_counter()
+    sequential = [client.chat.completions.create(**request).choices[0].message.content for request in requests]
+    sequential_rate = report_throughput(len(texts), time.perf_counter() - start, "sequential")
+
+    start = time.perf_counter()
+    concurrent = run_requests(requests, args.api_key, args.concurrency, args.rpm, args.tpm, args.base_url)
+    concurrent_rate = report_throughput(len(texts), time.perf_counter() - start, "concurrent")
+
+    assert concurrent == sequential
+    if sequential_rate > 0:
+        print(f"speedup: {concurrent_rate / sequential_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,18 @@
 import json
 import os
 import csv
-import difflib
 import argparse
+import corpus
+import evaluation_cache
+import similarity
+from concurrent.futures import ProcessPoolExecutor
 
 """
-This program is for evaluating the LLM's outputs automatically by comparing them with gold data. This evaluator uses a default similarity threshold of 0.7, which can be adjusted at line 236. To make the evaluation more stringent, increase the threshold; for a more flexible evaluation, decrease it. To run the program, run the following code: 
+This program is for evaluating the LLM's outputs automatically by comparing them with gold data. This evaluator uses a default similarity threshold of 0.7, which can be adjusted with `--threshold`. To make the evaluation more stringent, increase the threshold; for a more flexible evaluation, decrease it. To run the program, run the following code: 
 ```
 python auto_evaluator.py path/to/your/gold_files path/to/your/pred_files path/to/your/output "gold_file_name" "pred_file_name"
 ```
+With `--cache path/to/evaluation_cache.sqlite`, the counts of each file pair are kept (see evaluation_cache.py) and only the pairs whose files changed are scored again. With `--corpus-cache`, the gold and prediction directories are read from their binary corpus files (see corpus.py) instead of one json file at a time.
 """
 
 def main():
@@ -18,6 +22,11 @@ def main():
     parser.add_argument('output_path', type=str, help='Path to the output file')
     parser.add_argument('gold_name', type=str, help='Name of the gold files')
     parser.add_argument('pred_name', type=str, help='Name of the prediction files')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes scoring the file pairs in parallel')
+    parser.add_argument('--matching', type=str, default='greedy', choices=['greedy', 'hungarian'], help='How the entities and events are paired before scoring')
+    parser.add_argument('--threshold', type=float, default=0.7, help='Similarity above which a predicted entity or event counts as a match')
+    parser.add_argument('--cache', type=str, default=None, help='SQLite file keeping the counts of each file pair, so unchanged pairs are not scored again')
+    parser.add_argument('--corpus-cache', action='store_true', help='Read the gold and prediction directories from their binary corpus files (<directory>_corpus.bin, built on the first run)')
     args = parser.parse_args()
     gold_path = args.gold_path
     pred_path = args.pred_path
@@ -25,7 +34,7 @@ def main():
     gold_name = args.gold_name
     pred_name = args.pred_name
 
-    total_evaluation(gold_path, pred_path, output_path, gold_name, pred_name)
+    total_evaluation(gold_path, pred_path, output_path, gold_name, pred_name, args.workers, args.matching, args.threshold, args.cache, args.corpus_cache)
     
 # Function to calculate similarity between entity dictionaries (only considering "type" and "texts" fields)
 def calculate_similarity(dict1, dict2, entity_or_event):
@@ -34,10 +43,12 @@ def calculate_similarity(dict1, dict2, entity_or_event):
         type_similarity = 1 if dict1["type"] == dict2["type"] else 0
 
         # Calculate the text similarity as the average similarity of "texts" pairs
+        # (each texts2 column is scored in one batch, the sum keeps the original order)
+        ratios_by_text2 = [similarity.batch_ratios(dict1["texts"], text2) for text2 in dict2["texts"]]
         text_similarity = sum(
-            difflib.SequenceMatcher(None, text1, text2).ratio()
-            for text1 in dict1["texts"]
-            for text2 in dict2["texts"]
+            ratios_by_text2[index2][index1]
+            for index1 in range(len(dict1["texts"]))
+            for index2 in range(len(dict2["texts"]))
         ) / (len(dict1["texts"]) * len(dict2["texts"])) if (len(dict1["texts"]) * len(dict2["texts"])) > 0 else 0
 
         # Normalize text similarity to be between 0 and 1
@@ -67,32 +78,97 @@ def calculate_similarity(dict1, dict2, entity_or_event):
 
     return overall_similarity
 
-# Function to find best matches among entity dictionaries
-def find_best_matches_among_dicts(dict_list1, dict_list2, entity_or_event):
+# Function for the greedy matching on a precomputed similarity matrix. Taking the edges from the most to the least similar
+# (ties in index order) gives the same pairs, in the same order, as repeatedly picking the most similar remaining pair.
+def greedy_matching(similarity_matrix):
+    edges = [(-similarity, index1, index2)
+             for index1, row in enumerate(similarity_matrix)
+             for index2, similarity in enumerate(row) if similarity > 0]
+    edges.sort()
+    used_indices1 = set()
+    used_indices2 = set()
+    pairs = []
+    for negative_similarity, index1, index2 in edges:
+        if index1 not in used_indices1 and index2 not in used_indices2:
+            pairs.append((index1, index2, -negative_similarity))
+            used_indices1.add(index1)
+            used_indices2.add(index2)
+    return pairs
+
+# Function for the assignment maximizing the total similarity (Hungarian algorithm). Pairs with no similarity are left out.
+def hungarian_matching(similarity_matrix):
+    transposed = len(similarity_matrix) > len(similarity_matrix[0])
+    if transposed:
+        similarity_matrix = [list(column) for column in zip(*similarity_matrix)]
+    n, m = len(similarity_matrix), len(similarity_matrix[0])
+    # minimize the cost (1 - similarity), rows and columns are 1-based below
+    u, v, p, way = [0.0] * (n + 1), [0.0] * (m + 1), [0] * (m + 1), [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float('inf')] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0, delta, j1 = p[j0], float('inf'), 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = (1 - similarity_matrix[i0 - 1][j - 1]) - u[i0] - v[j]
+                    if current < minv[j]:
+                        minv[j], way[j] = current, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    pairs = []
+    for j in range(1, m + 1):
+        if p[j] != 0:
+            index1, index2 = (j - 1, p[j] - 1) if transposed else (p[j] - 1, j - 1)
+            similarity = similarity_matrix[p[j] - 1][j - 1]
+            if similarity > 0:
+                pairs.append((index1, index2, similarity))
+    pairs.sort()
+    return pairs
+
+# Function to find best matches among entity dictionaries. The similarity of every pair is computed once, then the pairs
+# are matched greedily (default) or with the Hungarian algorithm (matching="hungarian").
+# As before, the matched dictionaries are removed from dict_list1 and dict_list2.
+def find_best_matches_among_dicts(dict_list1, dict_list2, entity_or_event, matching="greedy"):
     if not dict_list1 or not dict_list2:
         return [], {}
 
-    best_matches = []
+    similarity_matrix = [[calculate_similarity(dict1, dict2, entity_or_event) for dict2 in dict_list2] for dict1 in dict_list1]
+    if matching == "hungarian":
+        pairs = hungarian_matching(similarity_matrix)
+    else:
+        pairs = greedy_matching(similarity_matrix)
 
-    while dict_list1 and dict_list2:
-        best_match, best_similarity, best_index1, best_index2 = None, 0, None, None
+    best_matches = [(dict_list1[index1], dict_list2[index2], similarity) for index1, index2, similarity in pairs]
+    matched_indices1 = set(index1 for index1, index2, similarity in pairs)
+    matched_indices2 = set(index2 for index1, index2, similarity in pairs)
+    remaining1 = [dict1 for index1, dict1 in enumerate(dict_list1) if index1 not in matched_indices1]
+    remaining2 = [dict2 for index2, dict2 in enumerate(dict_list2) if index2 not in matched_indices2]
 
-        for index1, dict1 in enumerate(dict_list1):
-            for index2, dict2 in enumerate(dict_list2):
-                current_similarity = calculate_similarity(dict1, dict2, entity_or_event)
+    # when nothing similar is left and one side has a single dictionary, it is paired with the first one of the other side
+    # (with similarity 0), and the last dictionary of each side is removed
+    if remaining1 and remaining2 and (len(remaining1) == 1 or len(remaining2) == 1):
+        best_matches.append((remaining1[0], remaining2[0], 0))
+        remaining1.pop()
+        remaining2.pop()
 
-                if current_similarity > best_similarity:
-                    best_match, best_similarity, best_index1, best_index2 = dict2, current_similarity, index1, index2
-
-        if best_match is not None:
-            best_matches.append((dict_list1[best_index1], best_match, best_similarity))
-            dict_list1.pop(best_index1)
-            dict_list2.pop(best_index2)
-
-        elif (len(dict_list1) == 1 or len(dict_list2) == 1) and best_match is None:
-            best_matches.append((dict_list1[0], dict_list2[0], 0))
-            dict_list1.pop()
-            dict_list2.pop()
+    dict_list1[:] = remaining1
+    dict_list2[:] = remaining2
 
     id_map = {}
     for matches in best_matches:
@@ -108,6 +184,7 @@ def find_best_matches_in_list(list1, list2):
     best_matches = []
     used_indices_list1 = set()
     used_indices_list2 = set()
+    pair_similarities = {}
 
     for _ in range(min(len(list1), len(list2))):
         best_match, best_similarity, best_index1, best_index2 = None, 0, None, None
@@ -120,9 +197,14 @@ def find_best_matches_in_list(list1, list2):
                 if index2 in used_indices_list2:
                     continue
 
-                # Compute the similarity ratio between item1 and item2
-                seq_matcher = difflib.SequenceMatcher(None, item1, item2)
-                current_similarity = seq_matcher.ratio()
+                # Compute the similarity ratio between item1 and item2 (each pair at most once), unless its
+                # upper bound shows it can't beat the best similarity of this round
+                current_similarity = pair_similarities.get((index1, index2))
+                if current_similarity is None:
+                    if similarity.upper_bound(item1, item2) <= best_similarity:
+                        continue
+                    current_similarity = similarity.ratio(item1, item2)
+                    pair_similarities[(index1, index2)] = current_similarity
 
                 if current_similarity > best_similarity:
                     best_match, best_similarity, best_index1, best_index2 = item2, current_similarity, index1, index2
@@ -207,8 +289,11 @@ def one_to_one_match_event(golden_event, prediction_event):
   final_similarity = similarity / (similarity + dissimilarity)
   return final_similarity
 
-# Function to read and parse a JSON file
+# Function to read and parse a JSON file (taken from the loaded corpus of its directory if there is one, see corpus.py)
 def read_json_file(file_path):
+    data = corpus.lookup(file_path)
+    if data is not None:
+        return data
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
             data = json.load(file)
@@ -220,7 +305,10 @@ def read_json_file(file_path):
         print(f"Error decoding JSON in file {file_path}: {e}")
         return None
 
-def auto_evaluation(golden_data, prediction_data):
+# The similarity data of a gold/prediction pair, which doesn't depend on the threshold: the similarities of the matched
+# entity texts and events, and the counts that no threshold changes. count_matches turns it into TP/FP/FN counts for a
+# threshold, so several thresholds can be compared without matching the files again.
+def score_pair(golden_data, prediction_data, matching="greedy"):
     # Check if both files were successfully loaded and parsed
     if golden_data is not None and prediction_data is not None:
         # Extract the dictionaries from the "entities" field of each JSON file
@@ -237,7 +325,7 @@ def auto_evaluation(golden_data, prediction_data):
         prediction_events = prediction_data.get("events", [])
 
         # Find the best matching pairs between the dictionaries
-        best_matches, id_map = find_best_matches_among_dicts(golden_entities, prediction_entities, "entity")
+        best_matches, id_map = find_best_matches_among_dicts(golden_entities, prediction_entities, "entity", matching)
 
         # Mapping the entity ids in events by using id_map
         prediction_events = mapping_ids(prediction_events, id_map)
@@ -248,12 +336,9 @@ def auto_evaluation(golden_data, prediction_data):
         # Check the number of each event type. There can be multiple dictionaries with the same event type.
         counts = counting_dict_for_each_type(golden_group, prediction_group)
 
-        # Initialize counters for TP, FP, and FN
-        entity_tp_count, entity_fp_count, entity_fn_count = 0, 0, 0
-        event_tp_count, event_fp_count, event_fn_count = 0, 0, 0
-
-        # Define the similarity threshold (e.g., 0.7 for 70%)
-        similarity_threshold = 0.7
+        # The FP and FN of the events that don't depend on the threshold, and the similarities of the matched events
+        event_fp_count, event_fn_count = 0, 0
+        event_similarities = []
 
         for key, value in counts.items():
           if value['golden'] == 0:
@@ -263,50 +348,52 @@ def auto_evaluation(golden_data, prediction_data):
           elif value['golden'] == 1 and value['prediction'] == 1:
             final_similarity = one_to_one_match_event(golden_group[key][0], prediction_group[key][0])
             print(final_similarity, str(key), str(golden_group[key][0]), str(prediction_group[key][0]))
-            if final_similarity >= similarity_threshold:
-              event_tp_count += 1
-            else:
-              event_fp_count += 1
-              event_fn_count += 1
+            event_similarities.append(final_similarity)
           else:
-            best_event_matches, event_id_map = find_best_matches_among_dicts(golden_group[key], prediction_group[key], "event")
+            best_event_matches, event_id_map = find_best_matches_among_dicts(golden_group[key], prediction_group[key], "event", matching)
             for matches in best_event_matches:
-              if matches[2] >= similarity_threshold:
-                event_tp_count += 1
-              else:
-                event_fp_count += 1
-                event_fn_count += 1
+              event_similarities.append(matches[2])
 
             event_fn_count += len(golden_group[key])
             event_fp_count += len(prediction_group[key])
 
         # Iterate through the best matching pairs and calculate similarity
-        entity_pairs_list = []
+        entity_similarities = []
         for golden_dict, prediction_dict, similarity in best_matches:
             # Calculate the similarity between "texts" values
             best_matching_entity_pairs = find_best_matches_in_list(golden_dict['texts'], prediction_dict['texts'])
             for pair in best_matching_entity_pairs:
               print(pair)
-              if pair[2] > similarity_threshold:
-                entity_tp_count += 1
+              entity_similarities.append(pair[2])
+
+        return {"golden_entities": len(golden_entities_list), "prediction_entities": len(prediction_entities_list),
+                "entity_similarities": entity_similarities, "event_similarities": event_similarities,
+                "event_fp": event_fp_count, "event_fn": event_fn_count}
 
-        # get the total matching entities in one list
-        flattened_entity_pairs = [item for sublist in entity_pairs_list for item in sublist]
+# The similarity data of a pair that isn't matched (the counts are the same for every threshold)
+def unmatched_scores(golden_entities, prediction_entities, event_fp, event_fn):
+    return {"golden_entities": golden_entities, "prediction_entities": prediction_entities,
+            "entity_similarities": [], "event_similarities": [], "event_fp": event_fp, "event_fn": event_fn}
 
-        for pair in flattened_entity_pairs:
-          print("pair: ", pair)
+# TP/FP/FN counts of a pair (from score_pair) at a similarity threshold
+def count_matches(scores, similarity_threshold=0.7):
+    # a matched event counts from the threshold on, a matched entity text above it
+    event_tp_count = sum(1 for similarity in scores["event_similarities"] if similarity >= similarity_threshold)
+    event_fp_count = scores["event_fp"] + len(scores["event_similarities"]) - event_tp_count
+    event_fn_count = scores["event_fn"] + len(scores["event_similarities"]) - event_tp_count
+    entity_tp_count = sum(1 for similarity in scores["entity_similarities"] if similarity > similarity_threshold)
 
-        # if prediction_entities_list contain more entities than the len of the flattened_entity_pairs,
-        # that means there are FPs.
-        if len(prediction_entities_list) > entity_tp_count:
-          entity_fp_count += len(prediction_entities_list) - entity_tp_count
+    # if the prediction contains more entities than the matching ones, that means there are FPs;
+    # if the gold data contains more entities than the matching ones, that means there are FNs.
+    entity_fp_count = max(0, scores["prediction_entities"] - entity_tp_count)
+    entity_fn_count = max(0, scores["golden_entities"] - entity_tp_count)
 
-        # if golden_entities_list contains more entities than the len of the flattened_entity_pairs,
-        # that means there are FNs.
-        if len(golden_entities_list) > entity_tp_count:
-          entity_fn_count += len(golden_entities_list) - entity_tp_count
+    return entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count
 
-        return entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count
+def auto_evaluation(golden_data, prediction_data, matching="greedy", similarity_threshold=0.7):
+    scores = score_pair(golden_data, prediction_data, matching)
+    if scores is not None:
+        return count_matches(scores, similarity_threshold)
 
 def get_json_files(directory):
     json_files = [file for file in os.listdir(directory) if file.endswith('.json')]
@@ -336,49 +423,89 @@ def get_precision_recall_f1(entity_tp, entity_fp, entity_fn, event_tp, event_fp,
   event_f1 = calculate_f1(event_precision, event_recall)
   return entity_precision, entity_recall, entity_f1, event_precision, event_recall, event_f1
 
-def total_evaluation(gold_path, prediction_path, output_path, gold_file_name, prediction_file_name):
-  # sanity check - check if there are same number of gold files and prediction files
-  gold_files = get_json_files(gold_path)
-  prediction_files = get_json_files(prediction_path)
-  assert len(gold_files) == len(prediction_files)
-
-  total_list = []
-  first_row = ['Gold', 'Prediction', 'Entity_TP', 'Entity_FP', 'Entity_FN', 'Event_TP', 'Event_FP', 'Event_FN', 'Entity_Precision', 'Entity_Recall', 'Entity_F1', 'Event_Precision', 'Event_Recall', 'Event_F1']
-  total_list.append(first_row)
-  n = 0
-  while n < len(gold_files):
-    print("processing "+str(n)+"th sentence!")
+# Paths of the n-th gold/prediction file pair
+def pair_files(gold_path, prediction_path, gold_file_name, prediction_file_name, n):
     golden_file = gold_path + "/"+ gold_file_name + str(n)+".json"
     prediction_file = prediction_path + "/"+ prediction_file_name +str(n) + ".json"
+    return golden_file, prediction_file
+
+# Row of the evaluation result from the TP/FP/FN counts of a file pair
+def make_row(golden_file, prediction_file, counts):
+    return [golden_file, prediction_file] + list(counts) + list(get_precision_recall_f1(*counts))
+
+# Similarity data of the n-th gold/prediction file pair (see score_pair). Returns the paths of the pair and its scores.
+def score_file_pair(gold_path, prediction_path, gold_file_name, prediction_file_name, n, matching="greedy"):
+    print("processing "+str(n)+"th sentence!")
+    golden_file, prediction_file = pair_files(gold_path, prediction_path, gold_file_name, prediction_file_name, n)
     golden_data = read_json_file(golden_file)
     prediction_data = read_json_file(prediction_file)
     if len(prediction_data['entities']) != 0:
       if 'texts' in prediction_data['entities'][0].keys():
-        entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count = auto_evaluation(golden_data, prediction_data)
-        entity_precision, entity_recall, entity_f1, event_precision, event_recall, event_f1 = get_precision_recall_f1(entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count)
+        scores = score_pair(golden_data, prediction_data, matching)
       else:
         print("**There's a format issue!**")
-        entity_tp_count = 0
-        entity_fp_count = len(prediction_data['entities'])
-        entity_fn_count = len(golden_data['entities'])
-        event_tp_count = 0
-        event_fp_count = len(prediction_data['events'])
-        event_fn_count = len(golden_data['events'])
-        entity_precision, entity_recall, entity_f1, event_precision, event_recall, event_f1 = get_precision_recall_f1(entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count)
-      row = [golden_file, prediction_file, entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count, entity_precision, entity_recall, entity_f1, event_precision, event_recall, event_f1]
-      total_list.append(row)
+        scores = unmatched_scores(len(golden_data['entities']), len(prediction_data['entities']), len(prediction_data['events']), len(golden_data['events']))
     else:
       print("**No entity extracted!**")
-      entity_tp_count = 0
-      entity_fp_count = 0
-      entity_fn_count = len(golden_data['events'])
-      event_tp_count = 0
-      event_fp_count = len(prediction_data['events'])
-      event_fn_count = len(golden_data['events'])
-      entity_precision, entity_recall, entity_f1, event_precision, event_recall, event_f1 = get_precision_recall_f1(entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count)
-      row = [golden_file, prediction_file, entity_tp_count, entity_fp_count, entity_fn_count, event_tp_count, event_fp_count, event_fn_count, entity_precision, entity_recall, entity_f1, event_precision, event_recall, event_f1]
-      total_list.append(row)
-    n += 1
+      scores = unmatched_scores(len(golden_data['events']), 0, len(prediction_data['events']), len(golden_data['events']))
+    return golden_file, prediction_file, scores
+
+# Function for evaluating the n-th gold/prediction file pair. Returns the row of the evaluation result.
+def evaluate_file_pair(gold_path, prediction_path, gold_file_name, prediction_file_name, n, matching="greedy", similarity_threshold=0.7):
+    golden_file, prediction_file, scores = score_file_pair(gold_path, prediction_path, gold_file_name, prediction_file_name, n, matching)
+    return make_row(golden_file, prediction_file, count_matches(scores, similarity_threshold))
+
+# Wrapper for the process pool (the arguments are packed in one tuple)
+def evaluate_file_pair_args(args):
+    return evaluate_file_pair(*args)
+
+def total_evaluation(gold_path, prediction_path, output_path, gold_file_name, prediction_file_name, workers=1, matching="greedy", similarity_threshold=0.7, cache_path=None, corpus_cache=False):
+  # sanity check - check if there are same number of gold files and prediction files
+  gold_files = get_json_files(gold_path)
+  prediction_files = get_json_files(prediction_path)
+  assert len(gold_files) == len(prediction_files)
+
+  total_list = []
+  first_row = ['Gold', 'Prediction', 'Entity_TP', 'Entity_FP', 'Entity_FN', 'Event_TP', 'Event_FP', 'Event_FN', 'Entity_Precision', 'Entity_Recall', 'Entity_F1', 'Event_Precision', 'Event_Recall', 'Event_F1']
+  total_list.append(first_row)
+  pair_args = [(gold_path, prediction_path, gold_file_name, prediction_file_name, n, matching, similarity_threshold) for n in range(len(gold_files))]
+  # the worker processes load the corpora too (from the cache files written here)
+  directories = [gold_path, prediction_path] if corpus_cache else []
+  corpus.load_directories(directories)
+
+  # the pairs whose files, threshold and matching were already scored get their counts from the cache
+  cache = evaluation_cache.open_cache(cache_path)
+  rows = [None] * len(pair_args)
+  keys = [None] * len(pair_args)
+  if cache is not None:
+    for n in range(len(pair_args)):
+      golden_file, prediction_file = pair_files(gold_path, prediction_path, gold_file_name, prediction_file_name, n)
+      keys[n] = cache.make_key(golden_file, prediction_file, similarity_threshold, matching)
+      counts = cache.get(keys[n])
+      if counts is not None:
+        rows[n] = make_row(golden_file, prediction_file, counts)
+  missing = [n for n in range(len(pair_args)) if rows[n] is None]
+
+  executor = ProcessPoolExecutor(max_workers=workers, initializer=corpus.load_directories, initargs=(directories,)) if workers > 1 else None
+  try:
+    if executor is not None:
+      # the file pairs are scored in parallel; map() returns the rows in file order, so the sums below are the same as in a serial run
+      missing_rows = executor.map(evaluate_file_pair_args, [pair_args[n] for n in missing], chunksize=max(1, len(missing) // (workers * 4)))
+    else:
+      missing_rows = (evaluate_file_pair(*pair_args[n]) for n in missing)
+    # each row is stored as soon as it is scored, so the pairs scored before an error are kept in the cache
+    for n, row in zip(missing, missing_rows):
+      rows[n] = row
+      if cache is not None:
+        cache.put(keys[n], row[2:8])
+  finally:
+    if executor is not None:
+      executor.shutdown(cancel_futures=True)
+    if cache is not None:
+      cache.close()
+  total_list.extend(rows)
+  if cache is not None:
+    cache.report()
 
   n = 0
   entity_tp_sum = 0
@@ -0,0 +1,100 @@
+import json
+import streaming
+
+"""
+This program packs several will texts into one classification request, so that the classification prompt is sent once per batch instead of once per text. It also writes the classification requests as a JSONL file for the OpenAI Batch API and reads the results file back. In every mode the output is one 9-dim label vector per text, in the order of the input texts.
+"""
+
+BATCH_INSTRUCTIONS = """
+You will be given several will texts, each starting with its number in square brackets (e.g. [1]). Classify each will text separately following the instructions above. Give me the result as a JSON object of the form {"results": [[...], [...], ...]}, with one list of 9 labels per will text, in the same order as the will texts (only the JSON object).
+"""
+
+
+def make_batches(text_list, batch_size):
+    return [text_list[n:n + batch_size] for n in range(0, len(text_list), batch_size)]
+
+
+def pack_texts(text_batch):
+    return "\n\n".join("[" + str(n + 1) + "] " + text for n, text in enumerate(text_batch))
+
+
+def batch_classification_request(prompt, text_batch):
+    return {
+        "model": "gpt-3.5-turbo-0125",
+        "response_format": {
+            'type': 'json_object',
+        },
+        "messages": [
+            {
+                "role": "system",
+                "content": prompt + BATCH_INSTRUCTIONS
+            },
+            {
+                "role": "user",
+                "content": pack_texts(text_batch)
+            }
+        ],
+        "temperature": 0,
+        "max_tokens": 4096,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0
+    }
+
+
+def is_label_vector(labels):
+    return isinstance(labels, list) and len(labels) == 9 and all(label in (0, 1) for label in labels)
+
+
+# Returns the label vectors of a batched response, or None if the response doesn't have one valid vector per text
+def parse_batch_response(content, batch_length):
+    try:
+        results = json.loads(content)["results"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+    if not isinstance(results, list) or len(results) != batch_length:
+        return None
+    if not all(is_label_vector(labels) for labels in results):
+        return None
+    return [[int(label) for label in labels] for labels in results]
+
+
+# Writes one Batch API request per batch of texts (text_list can be any iterable). The custom_id keeps the range of rows covered by the request.
+def write_batch_file(text_list, prompt, output_file, batch_size=20):
+    n = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for text_batch in streaming.chunked(text_list, batch_size):
+            line = {
+                "custom_id": "rows-" + str(n) + "-" + str(n + len(text_batch)),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": batch_classification_request(prompt, text_batch)
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            n += len(text_batch)
+    return n
+
+
+# Reads a Batch API results file into a dict of row index -> label vector. Rows whose request failed or whose
+# response couldn't be parsed are left out.
+def read_batch_results(results_file):
+    preds = {}
+    with open(results_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            _, start, end = result["custom_id"].split("-")
+            start, end = int(start), int(end)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                print("batch request " + result["custom_id"] + " failed")
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            labels = parse_batch_response(content, end - start)
+            if labels is None:
+                print("batch request " + result["custom_id"] + " returned an unexpected output")
+                continue
+            for n, row_labels in zip(range(start, end), labels):
+                preds[n] = row_labels
+    return preds
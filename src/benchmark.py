@@ -0,0 +1,362 @@
+import argparse
+import contextlib
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import auto_evaluator
+import create_full_prompt
+import similarity
+
+"""
+This program benchmarks the evaluator and the prompt construction, and keeps a history of the timings so that a change can be checked for regressions. A run times `total_evaluation` and `auto_evaluation` (per file) on the gold splits (`dev_gold`, `test_gold`, `ood_gold`), and `make_example_pool` and `create_full_prompt.main` on the example pool. With `--scales`, the same benchmarks also run on synthetic corpora made of that many copies of the original files. The predictions are the gold files with seeded perturbations (cut texts, changed types, dropped entities), so the evaluator has real matching work to do. To run the benchmark and append its timings to a history file, run the following code:
+```
+python benchmark.py run ../data --scales 1 10 --history benchmark_history.json
+```
+To compare the last run of the history with the run before it (exit status 1 if a timing got slower by more than the threshold), run the following code:
+```
+python benchmark.py compare benchmark_history.json --threshold 0.2
+```
+The example pool construction can also be compared with the legacy list-scan builder, up to `--legacy-max` examples since it is quadratic in the pool size:
+```
+python benchmark.py pool ../data/example_pool --sizes 200 1000 10000 100000
+```
+"""
+
+# split -> (gold directory, gold file name)
+GOLD_SPLITS = {
+    "dev": ("dev_gold", "dev_human_annotations_"),
+    "test": ("test_gold", "test_human_annotations_"),
+    "ood": ("ood_gold", "ood_human_annotations_"),
+}
+EXAMPLE_POOL = "example_pool"
+
+
+# The previous implementation, kept for comparison: membership is checked by scanning the bucket list
+def legacy_make_example_pool(json_data):
+    events = create_full_prompt.EVENT_TYPES
+    sort_by_type = {}
+    for k, v in json_data.items():
+        event_sorted = False
+        for e in v['events']:
+            for event in events:
+                if e['type'] == event:
+                    if event in sort_by_type and (k, v) not in sort_by_type[event]:
+                        event_sorted = True
+                        sort_by_type[event].append((k, v))
+                    elif event not in sort_by_type:
+                        event_sorted = True
+                        sort_by_type[event] = [(k, v)]
+        if event_sorted == False:
+            if 'Etc' not in sort_by_type:
+                sort_by_type['Etc'] = [(k, v)]
+            else:
+                sort_by_type['Etc'].append((k, v))
+    return sort_by_type
+
+
+# Makes a pool of the given size by repeating the files of the directory under new filenames
+def scale_json_data(json_data, size):
+    items = list(json_data.items())
+    scaled = {}
+    for n in range(size):
+        filename, data = items[n % len(items)]
+        scaled[str(n // len(items)) + "_" + filename] = data
+    return scaled
+
+
+def time_function(function, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_example_pool(directory, sizes, legacy_max=10000):
+    json_data = create_full_prompt.read_json_files(directory)
+    rows = []
+    for size in sizes:
+        scaled = scale_json_data(json_data, size)
+        indexed_time, indexed_pool = time_function(create_full_prompt.make_example_pool, scaled)
+        legacy_time = None
+        if size <= legacy_max:
+            legacy_time, legacy_pool = time_function(legacy_make_example_pool, scaled, repeat=1)
+            assert legacy_pool == indexed_pool
+        rows.append({"size": size, "indexed_seconds": indexed_time, "legacy_seconds": legacy_time})
+    return rows
+
+
+def print_rows(rows):
+    print(f"{'examples':>10} {'indexed (s)':>12} {'legacy (s)':>12} {'speedup':>9}")
+    for row in rows:
+        legacy = row["legacy_seconds"]
+        legacy_text = f"{legacy:12.4f}" if legacy is not None else f"{'-':>12}"
+        speedup_text = f"{legacy / row['indexed_seconds']:8.1f}x" if legacy is not None else f"{'-':>9}"
+        print(f"{row['size']:>10} {row['indexed_seconds']:12.4f} {legacy_text} {speedup_text}")
+
+
+# A prediction made from a gold file: some texts are cut or extended, some types are changed and the last entity may be dropped
+def perturb_prediction(gold_data, rng):
+    prediction = copy.deepcopy(gold_data)
+    entities = prediction.get('entities', [])
+    rng.shuffle(entities)
+    for entity in entities:
+        if rng.random() < 0.3 and entity['texts']:
+            text = entity['texts'][0]
+            entity['texts'][0] = text[:max(1, len(text) - rng.randint(0, 6))] + rng.choice(['', 's', ' the'])
+        if rng.random() < 0.1:
+            entity['type'] = rng.choice(['Testator', 'Asset', 'Will'])
+    if rng.random() < 0.2 and entities:
+        entities.pop()
+    events = prediction.get('events', [])
+    rng.shuffle(events)
+    for event in events:
+        if rng.random() < 0.2:
+            event['type'] = rng.choice(['Bequest', 'Direction'])
+    return prediction
+
+
+def read_gold_files(gold_path, gold_file_name):
+    num_files = len(auto_evaluator.get_json_files(gold_path))
+    return [auto_evaluator.read_json_file(gold_path + "/" + gold_file_name + str(n) + ".json") for n in range(num_files)]
+
+
+# Writes scale copies of the gold files and one perturbed prediction per copy (seeded by the copy number), named gold_<n>.json and pred_<n>.json
+def write_corpus(gold_data, scale, output_path, seed=0):
+    gold_dir = os.path.join(output_path, "gold")
+    pred_dir = os.path.join(output_path, "pred")
+    os.makedirs(gold_dir, exist_ok=True)
+    os.makedirs(pred_dir, exist_ok=True)
+    for n in range(scale * len(gold_data)):
+        data = gold_data[n % len(gold_data)]
+        with open(os.path.join(gold_dir, "gold_" + str(n) + ".json"), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        with open(os.path.join(pred_dir, "pred_" + str(n) + ".json"), 'w', encoding='utf-8') as f:
+            json.dump(perturb_prediction(data, random.Random(seed * 1000003 + n)), f)
+    return gold_dir, pred_dir
+
+
+# The similarity caches are emptied before each timing, so a repetition doesn't reuse the ratios of the previous one
+def clear_similarity_caches():
+    similarity.cached_ratios.clear()
+    similarity.character_counts.cache_clear()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def time_total_evaluation(gold_dir, pred_dir, output_path, workers, matching, repeat):
+    best = None
+    for _ in range(repeat):
+        clear_similarity_caches()
+        start = time.perf_counter()
+        # the evaluator prints a line per file, which would be timed as well
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            auto_evaluator.total_evaluation(gold_dir, pred_dir, output_path, "gold_", "pred_", workers, matching)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Times auto_evaluation on each file pair (read from disk beforehand, copied before each call since the matching changes the lists)
+def time_auto_evaluation(gold_dir, pred_dir, num_files, matching):
+    pairs = [(auto_evaluator.read_json_file(gold_dir + "/gold_" + str(n) + ".json"), auto_evaluator.read_json_file(pred_dir + "/pred_" + str(n) + ".json")) for n in range(num_files)]
+    clear_similarity_caches()
+    timings = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for gold_data, prediction_data in pairs:
+            gold_data, prediction_data = copy.deepcopy(gold_data), copy.deepcopy(prediction_data)
+            if not prediction_data['entities'] or 'texts' not in prediction_data['entities'][0]:
+                continue
+            start = time.perf_counter()
+            auto_evaluator.auto_evaluation(gold_data, prediction_data, matching)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_evaluation(data_path, split, scale, workers=1, matching="greedy", repeat=3, seed=0):
+    gold_dir_name, gold_file_name = GOLD_SPLITS[split]
+    gold_data = read_gold_files(os.path.join(data_path, gold_dir_name), gold_file_name)
+    results = {}
+    if not gold_data:
+        print("skipping the " + split + " split: no gold files in " + os.path.join(data_path, gold_dir_name))
+        return results
+    with tempfile.TemporaryDirectory() as tmp:
+        gold_dir, pred_dir = write_corpus(gold_data, scale, tmp, seed)
+        num_files = scale * len(gold_data)
+        name = "evaluation/" + split + "/x" + str(scale) + "/"
+        results[name + "total_evaluation"] = time_total_evaluation(gold_dir, pred_dir, tmp, workers, matching, repeat)
+        timings = time_auto_evaluation(gold_dir, pred_dir, num_files, matching)
+        results[name + "auto_evaluation_sum"] = sum(timings)
+        results[name + "auto_evaluation_mean"] = sum(timings) / len(timings)
+        results[name + "auto_evaluation_p95"] = percentile(timings, 0.95)
+        results[name + "auto_evaluation_max"] = max(timings)
+    return results
+
+
+# Times make_example_pool, and create_full_prompt.main with a cold (directory read) and a warm (already loaded) example pool
+def benchmark_prompt(data_path, scale, repeat=3, seed=0):
+    directory = os.path.join(data_path, EXAMPLE_POOL)
+    json_data = create_full_prompt.read_json_files(directory)
+    results = {}
+    name = "prompt/x" + str(scale) + "/"
+    with tempfile.TemporaryDirectory() as tmp:
+        if scale > 1:
+            scaled = scale_json_data(json_data, scale * len(json_data))
+            for filename, data in scaled.items():
+                with open(os.path.join(tmp, filename), 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+            directory = tmp
+        else:
+            scaled = json_data
+        results[name + "make_example_pool"], _ = time_function(create_full_prompt.make_example_pool, scaled, repeat=repeat)
+
+        def cold_prompt():
+            create_full_prompt._example_pools.pop(os.path.abspath(directory), None)
+            return create_full_prompt.main(directory)
+
+        random.seed(seed)
+        results[name + "create_full_prompt_cold"], _ = time_function(cold_prompt, repeat=repeat)
+        random.seed(seed)
+        results[name + "create_full_prompt_warm"], _ = time_function(create_full_prompt.main, directory, repeat=repeat)
+        create_full_prompt._example_pools.pop(os.path.abspath(directory), None)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(data_path, scales, splits, workers=1, matching="greedy", repeat=3, seed=0):
+    results = {}
+    for scale in scales:
+        for split in splits:
+            print("benchmarking the evaluator on " + split + " x" + str(scale))
+            results.update(benchmark_evaluation(data_path, split, scale, workers, matching, repeat, seed))
+        print("benchmarking the prompt construction x" + str(scale))
+        results.update(benchmark_prompt(data_path, scale, repeat, seed))
+    return results
+
+
+def read_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def append_history(history_file, run):
+    history = read_history(history_file)
+    history.append(run)
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=4)
+    return history
+
+
+def run_name(run):
+    return (run.get("label") or run["timestamp"]) + (" (" + run["commit"] + ")" if run.get("commit") else "")
+
+
+# Compares the timings of two runs. A timing is a regression when it got slower by more than the threshold (0.2 = 20%);
+# timings below min_seconds in both runs are too noisy to be compared and are never flagged.
+def compare_runs(baseline, current, threshold=0.2, min_seconds=0.001):
+    rows = []
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        before = baseline["results"][name]
+        after = current["results"][name]
+        change = (after - before) / before if before > 0 else 0.0
+        regression = change > threshold and max(before, after) >= min_seconds
+        rows.append({"name": name, "baseline_seconds": before, "current_seconds": after, "change": change, "regression": regression})
+    return rows
+
+
+def print_comparison(baseline, current, rows):
+    print("baseline: " + run_name(baseline))
+    print("current:  " + run_name(current))
+    width = max([len(row["name"]) for row in rows] + [9])
+    print(f"{'benchmark':<{width}} {'baseline (s)':>13} {'current (s)':>12} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<{width}} {row['baseline_seconds']:13.4f} {row['current_seconds']:12.4f} {row['change']:+8.1%}{flag}")
+    regressions = sum(1 for row in rows if row["regression"])
+    print(str(regressions) + " regression(s) out of " + str(len(rows)) + " benchmarks")
+    return regressions
+
+
+# Compares the last run of the history with the run at index baseline (the run before it by default)
+def compare_history(history_file, baseline=-2, threshold=0.2, min_seconds=0.001):
+    history = read_history(history_file)
+    if len(history) < 2:
+        print("the history needs at least two runs to compare")
+        return 0
+    rows = compare_runs(history[baseline], history[-1], threshold, min_seconds)
+    return print_comparison(history[baseline], history[-1], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the evaluator and the prompt construction')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and append the timings to the history file')
+    run_parser.add_argument('data_path', type=str, help='Path to the data directory (with the *_gold directories and example_pool)')
+    run_parser.add_argument('--history', type=str, default='benchmark_history.json', help='JSON file keeping the timings of every run')
+    run_parser.add_argument('--label', type=str, default=None, help='Name of the run in the history')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], help='Corpus sizes, as multiples of the original files (e.g. 1 10 100 1000)')
+    run_parser.add_argument('--splits', type=str, nargs='+', default=list(GOLD_SPLITS), choices=list(GOLD_SPLITS), help='Gold splits to benchmark')
+    run_parser.add_argument('--workers', type=int, default=1, help='Number of processes for total_evaluation')
+    run_parser.add_argument('--matching', type=str, default='greedy', choices=['greedy', 'hungarian'], help='Matching used by the evaluator')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions (the best time is kept)')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic predictions and of the example selection')
+    run_parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown flagged as a regression against the previous run')
+
+    compare_parser = subparsers.add_parser('compare', help='compare the last run of the history with an earlier one')
+    compare_parser.add_argument('history', type=str, help='JSON history file')
+    compare_parser.add_argument('--baseline', type=int, default=-2, help='Index of the baseline run in the history (default: the run before the last one)')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown flagged as a regression (0.2 = 20%%)')
+    compare_parser.add_argument('--min-seconds', type=float, default=0.001, help='Timings below this are not flagged')
+
+    pool_parser = subparsers.add_parser('pool', help='compare the example pool construction with the legacy builder')
+    pool_parser.add_argument('example_pool', type=str, help='Path to the example pool directory')
+    pool_parser.add_argument('--sizes', type=int, nargs='+', default=[200, 1000, 10000, 100000], help='Pool sizes to benchmark')
+    pool_parser.add_argument('--legacy-max', type=int, default=10000, help='Largest pool size for the legacy builder')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmarks(args.data_path, args.scales, args.splits, args.workers, args.matching, args.repeat, args.seed)
+        run = {
+            "label": args.label,
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "settings": {"scales": args.scales, "splits": args.splits, "workers": args.workers, "matching": args.matching, "repeat": args.repeat, "seed": args.seed},
+            "results": results,
+        }
+        history = append_history(args.history, run)
+        for name, seconds in results.items():
+            print(f"{name:<50} {seconds:10.4f}s")
+        print("saved to " + args.history + " (run " + str(len(history)) + ")")
+        if len(history) >= 2:
+            rows = compare_runs(history[-2], history[-1], args.threshold)
+            sys.exit(1 if print_comparison(history[-2], history[-1], rows) else 0)
+    elif args.command == 'compare':
+        sys.exit(1 if compare_history(args.history, args.baseline, args.threshold, args.min_seconds) else 0)
+    else:
+        print_rows(benchmark_example_pool(args.example_pool, args.sizes, args.legacy_max))
+
+
+if __name__ == "__main__":
+    main()
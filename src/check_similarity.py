@@ -0,0 +1,134 @@
+import argparse
+import copy
+import difflib
+import auto_evaluator
+import similarity
+
+"""
+This program checks that the similarity kernel (`similarity.py`) and the evaluator functions built on it give exactly the same scores and TP/FP/FN counts as the plain difflib implementation. Without prediction files, each gold file is compared with itself and with the next gold file. To run the check on the test split, run the following code:
+```
+python check_similarity.py ../data/test_gold test_human_annotations_
+```
+or, with prediction files:
+```
+python check_similarity.py ../data/test_gold test_human_annotations_ --pred-path path/to/your/pred_files --pred-name test_five_shots_classification_
+```
+"""
+
+
+# the event similarity doesn't use the kernel, so it is taken as is
+calculate_event_similarity = auto_evaluator.calculate_similarity
+
+
+# The implementations before the similarity kernel, used as the reference
+def reference_calculate_similarity(dict1, dict2, entity_or_event):
+    if entity_or_event == "entity":
+        type_similarity = 1 if dict1["type"] == dict2["type"] else 0
+        text_similarity = sum(
+            difflib.SequenceMatcher(None, text1, text2).ratio()
+            for text1 in dict1["texts"]
+            for text2 in dict2["texts"]
+        ) / (len(dict1["texts"]) * len(dict2["texts"])) if (len(dict1["texts"]) * len(dict2["texts"])) > 0 else 0
+        text_similarity = min(1.0, text_similarity)
+        return 0.7 * type_similarity + 0.3 * text_similarity
+    return calculate_event_similarity(dict1, dict2, entity_or_event)
+
+
+def reference_find_best_matches_in_list(list1, list2):
+    if not list1 or not list2:
+        return []
+
+    best_matches = []
+    used_indices_list1 = set()
+    used_indices_list2 = set()
+
+    for _ in range(min(len(list1), len(list2))):
+        best_match, best_similarity, best_index1, best_index2 = None, 0, None, None
+
+        for index1, item1 in enumerate(list1):
+            if index1 in used_indices_list1:
+                continue
+
+            for index2, item2 in enumerate(list2):
+                if index2 in used_indices_list2:
+                    continue
+
+                seq_matcher = difflib.SequenceMatcher(None, item1, item2)
+                current_similarity = seq_matcher.ratio()
+
+                if current_similarity > best_similarity:
+                    best_match, best_similarity, best_index1, best_index2 = item2, current_similarity, index1, index2
+
+        if best_match is not None:
+            best_matches.append((list1[best_index1], best_match, best_similarity))
+            used_indices_list1.add(best_index1)
+            used_indices_list2.add(best_index2)
+
+    return best_matches
+
+
+def check_scores(golden_data, prediction_data):
+    checked = 0
+    for golden_entity in golden_data.get("entities", []):
+        for prediction_entity in prediction_data.get("entities", []):
+            texts1, texts2 = golden_entity["texts"], prediction_entity["texts"]
+            for text2 in texts2:
+                batch = similarity.batch_ratios(texts1, text2)
+                for text1, batch_score in zip(texts1, batch):
+                    expected = difflib.SequenceMatcher(None, text1, text2).ratio()
+                    assert similarity.ratio(text1, text2) == expected, (text1, text2)
+                    assert batch_score == expected, (text1, text2)
+                    assert similarity.upper_bound(text1, text2) >= expected, (text1, text2)
+                    above = similarity.ratio_above(text1, text2, 0.7)
+                    assert (above is None and expected <= 0.7) or above == expected, (text1, text2)
+                    checked += 1
+            assert auto_evaluator.find_best_matches_in_list(texts1, texts2) == reference_find_best_matches_in_list(texts1, texts2)
+            assert auto_evaluator.calculate_similarity(golden_entity, prediction_entity, "entity") == reference_calculate_similarity(golden_entity, prediction_entity, "entity")
+    return checked
+
+
+# auto_evaluation with the reference functions swapped in
+def reference_auto_evaluation(golden_data, prediction_data):
+    current = auto_evaluator.find_best_matches_in_list, auto_evaluator.calculate_similarity
+    auto_evaluator.find_best_matches_in_list = reference_find_best_matches_in_list
+    auto_evaluator.calculate_similarity = reference_calculate_similarity
+    try:
+        return auto_evaluator.auto_evaluation(golden_data, prediction_data)
+    finally:
+        auto_evaluator.find_best_matches_in_list, auto_evaluator.calculate_similarity = current
+
+
+def check_counts(golden_data, prediction_data):
+    if not prediction_data.get("entities") or 'texts' not in prediction_data["entities"][0]:
+        return
+    expected = reference_auto_evaluation(copy.deepcopy(golden_data), copy.deepcopy(prediction_data))
+    actual = auto_evaluator.auto_evaluation(copy.deepcopy(golden_data), copy.deepcopy(prediction_data))
+    assert actual == expected, (actual, expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the similarity kernel against difflib')
+    parser.add_argument('gold_path', type=str, help='Path to the gold files')
+    parser.add_argument('gold_name', type=str, help='Name of the gold files')
+    parser.add_argument('--pred-path', type=str, default=None, help='Path to the prediction files')
+    parser.add_argument('--pred-name', type=str, default=None, help='Name of the prediction files')
+    args = parser.parse_args()
+
+    num_files = len(auto_evaluator.get_json_files(args.gold_path))
+    gold = [auto_evaluator.read_json_file(args.gold_path + "/" + args.gold_name + str(n) + ".json") for n in range(num_files)]
+    checked_pairs = 0
+    checked_scores = 0
+    for n in range(num_files):
+        if args.pred_path is not None:
+            predictions = [auto_evaluator.read_json_file(args.pred_path + "/" + args.pred_name + str(n) + ".json")]
+        else:
+            predictions = [gold[n], gold[(n + 1) % num_files]]
+        for prediction_data in predictions:
+            checked_scores += check_scores(gold[n], prediction_data)
+            check_counts(gold[n], prediction_data)
+            checked_pairs += 1
+    print("same scores and TP/FP/FN counts as difflib for " + str(checked_pairs) + " file pairs (" + str(checked_scores) + " text pairs)")
+
+
+if __name__ == "__main__":
+    main()
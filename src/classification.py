@@ -1,105 +1,129 @@
 import os
 import csv
-import create_full_prompt
-from openai import OpenAI
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_random_exponential,
-)  # for exponential backoff
-
-
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
-def extract_information(prompt, target_text, model_name, client):
-    response = client.chat.completions.create(
-      model=model_name,
-      response_format={
-        'type': 'json_object',
-      },
-      messages=[
-        {
-          "role": "system",
-          "content": prompt
-        },
-        {
-          "role": "user",
-          "content": target_text
-        }
-      ],
-      temperature=0,
-      max_tokens=4096,
-      top_p=1,
-      frequency_penalty=0,
-      presence_penalty=0
-    )
-    return response
-
-
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+import time
+import async_engine
+import batch_classification
+import local_classifier
+import metrics
+import streaming
+
+
+# The requests are retried with exponential backoff, and their latency, retries and tokens recorded (see metrics.py)
 def classification(prompt, target_text, client):
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo-0125",
-        messages=[
-            {
-              "role": "system",
-              "content": prompt
-            },
-            {
-              "role": "user",
-              "content": target_text
-            }
-          ],
-        temperature=0,
-        max_tokens=4096,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-        )
-    return response
-
-
-def classify_text_list(text_list, client):
+    return metrics.call("classify", client, async_engine.classification_request(prompt, target_text))
+
+
+def classification_batch(prompt, text_batch, client):
+    return metrics.call("classify_batch", client, batch_classification.batch_classification_request(prompt, text_batch))
+
+
+def read_classification_prompt():
     with open("classification_prompt.txt", 'r') as file:
-        prompt = file.read()
+        return file.read()
+
+
+# The classifier can be any object with a predict(text_list) method returning one label vector per text
+# (see local_classifier.py). Without a classifier, the texts are classified by the LLM. With return_exceptions,
+# a text whose request failed gets the exception instead of its label vector.
+def classify_text_list(text_list, client, batch_size=1, classifier=None, return_exceptions=False):
+    if classifier is not None:
+        total_classifications = classifier.predict(list(text_list))
+        assert len(text_list) == len(total_classifications)
+        return total_classifications
+    prompt = read_classification_prompt()
+    if batch_size > 1:
+        return classify_in_batches(text_list, prompt, client, batch_size, return_exceptions)
     total_classifications = []
     for text in text_list:
-        classification_result = classification(prompt, text, client)
+        try:
+            classification_result = classification(prompt, text, client)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            total_classifications.append(e)
+            continue
         total_classifications.append(eval(classification_result.choices[0].message.content))
     assert len(text_list) == len(total_classifications)
     return total_classifications
 
 
-def main(text_list):
-    # prompt the user to choose model
-    model_name = input("Please choose the model (gpt-4-1106-preview or gpt-4o-mini-2024-07-18): ")
+# Sends batch_size texts per request. A batch whose output doesn't have one label vector per text (or whose request
+# failed) is classified again one text at a time.
+def classify_in_batches(text_list, prompt, client, batch_size, return_exceptions=False):
+    total_classifications = []
+    for text_batch in batch_classification.make_batches(text_list, batch_size):
+        try:
+            response = classification_batch(prompt, text_batch, client)
+        except Exception:
+            if not return_exceptions:
+                raise
+            response = None
+        labels = batch_classification.parse_batch_response(response.choices[0].message.content, len(text_batch)) if response is not None else None
+        if labels is None:
+            print("batch output could not be parsed, classifying the texts one by one")
+            labels = classify_text_list(text_batch, client, return_exceptions=return_exceptions)
+        total_classifications += labels
+    assert len(text_list) == len(total_classifications)
+    return total_classifications
+
 
-    # ask the user for the directory and num_of_examples (used for prompt creation)
-    directory = input("Please provide the path to the prompt examples: ")
-    num_of_examples = input("How many examples do you want to use for each event type? ")
+# Takes the classification of the texts from the Batch API results (a dict of row index -> label vector, see
+# batch_classification.read_batch_results). Rows missing from the results are classified online.
+def classify_from_results(batch_results, indices, texts, client, return_exceptions=False):
+    preds = [batch_results.get(n) for n in indices]
+    missing = [position for position, labels in enumerate(preds) if labels is None]
+    if missing:
+        print(str(len(missing)) + " texts are missing from the batch results, classifying them online")
+        missing_preds = classify_text_list([texts[position] for position in missing], client, return_exceptions=return_exceptions)
+        for position, labels in zip(missing, missing_preds):
+            preds[position] = labels
+    return preds
 
-    if model_name in ['gpt-4-1106-preview', 'gpt-4o-mini-2024-07-18']:
-        # prompt the user for their api key
-        key = input("Please enter your openai api key: ")
-        client = OpenAI(api_key=key)
+
+# text_list can be any iterable (e.g. a csv file read row by row). The texts are classified and extracted chunk by chunk,
+# with the settings, the client and the extraction stage of the pipeline (see pipeline.py).
+# With a writer (see result_writer.py), each result is saved as soon as it is received, the texts already in the
+# writer's manifest are skipped, failed texts are skipped instead of ending the run, and the number of saved results is returned.
+def run(pipeline, text_list, writer=None):
+    classifier = local_classifier.load_classifier(pipeline.classifier_model) if pipeline.classifier_model is not None else None
+    batch_results = batch_classification.read_batch_results(pipeline.classify_results_file) if pipeline.classify_results_file is not None else None
+    writer = pipeline.wrap_writer(writer)
+    start = time.perf_counter()
+
+    extracted_info = []
+    for chunk in streaming.chunked(pipeline.rows(text_list), pipeline.chunk_size):
+        chunk = list(pipeline.pending(chunk, writer))
+        indices = [n for n, text in chunk]
+        texts = [text for n, text in chunk]
 
         # make predictions using pretrained models
-        preds = classify_text_list(text_list, client)
+        if classifier is not None:
+            preds = classify_text_list(texts, pipeline.client, classifier=classifier)
+        elif batch_results is not None:
+            preds = classify_from_results(batch_results, indices, texts, pipeline.client, writer is not None)
+        elif pipeline.concurrency > 1:
+            preds = async_engine.classify_text_list(texts, read_classification_prompt(), pipeline.api_key, pipeline.concurrency, pipeline.rpm, pipeline.tpm, pipeline.base_url, pipeline.cache, pipeline.classify_batch_size, writer is not None)
+        else:
+            preds = classify_text_list(texts, pipeline.client, pipeline.classify_batch_size, return_exceptions=writer is not None)
 
-        # check if the length of preds and text_list are equal
-        assert len(preds) == len(text_list)
+        # check if the length of preds and texts are equal
+        assert len(preds) == len(texts)
+
+        # the texts that couldn't be classified go to the dead-letter file instead of ending the run
+        if writer is not None:
+            for n, pred in zip(indices, preds):
+                if isinstance(pred, Exception):
+                    print("something went wrong while classifying " + str(n) + "th text!")
+                    writer.fail(n, "classify", pred)
+            classified = [(n, text, pred) for n, text, pred in zip(indices, texts, preds) if not isinstance(pred, Exception)]
+            indices, texts, preds = [n for n, text, pred in classified], [text for n, text, pred in classified], [pred for n, text, pred in classified]
 
         # using predictions, create prompts and extract information
-        extracted_info = []
-        n = 0
-        while n < len(text_list):
-            print("processing " + str(n+1) + "th sentence!")
-            # try:
-            full_prompt = create_full_prompt.main(directory, preds[n], num_of_examples)
-            response = extract_information(full_prompt, text_list[n], model_name, client)
-            extracted_info.append(response.choices[0].message.content)
-            n += 1
-            # except:
-            #     print("something went wrong while processing " + str(n) + "th text!")
-        return extracted_info
-    else:
-        print("Please choose between gpt-4-1106-preview and gpt-4o-mini-2024-07-18!")
+        chunk_info = pipeline.extract(pipeline.with_prompts(zip(indices, texts, preds), writer), writer)
+        if writer is None:
+            extracted_info += chunk_info
+            if len(chunk_info) < len(texts):
+                break
+
+    pipeline.report(writer.written if writer is not None else len(extracted_info), start)
+    return writer.written if writer is not None else extracted_info
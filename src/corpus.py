@@ -0,0 +1,242 @@
+import argparse
+import json
+import marshal
+import os
+import sys
+import time
+
+"""
+This program loads a whole directory of gold or prediction json files (e.g. `data/test_gold`) into a compact form: each file becomes a Document of `__slots__` records (Entity, Event) with tuples instead of lists, and the types, roles, ids and key orders are interned, so the thousands of repeated strings are stored once. The corpus is saved to a binary cache file next to the directory (`<directory>_corpus.bin`, written with `marshal`), which is loaded instead of parsing the json files again as long as the files don't change. `Document.to_dict()` gives back the same dict as `json.load` (same keys in the same order), so the evaluator works on it unchanged. To build the cache of a directory and compare the load times, run the following code:
+```
+python corpus.py ../data/test_gold
+```
+"""
+
+# bumped when the layout of the cache changes
+CACHE_VERSION = 1
+
+
+class Entity:
+    __slots__ = ('id', 'type', 'texts', 'keys')
+
+    def __init__(self, id, type, texts, keys):
+        self.id = id
+        self.type = type
+        self.texts = texts
+        # the keys of the json object in their order (one interned tuple shared by all the entities with the same order)
+        self.keys = keys
+
+    def to_dict(self):
+        values = {'id': self.id, 'type': self.type, 'texts': list(self.texts) if self.texts is not None else None}
+        return {key: values[key] for key in self.keys}
+
+
+class Event:
+    __slots__ = ('id', 'type', 'arguments', 'keys')
+
+    def __init__(self, id, type, arguments, keys):
+        self.id = id
+        self.type = type
+        # (role, entity ids) pairs
+        self.arguments = arguments
+        self.keys = keys
+
+    def to_dict(self):
+        values = {'id': self.id, 'type': self.type}
+        values.update((role, list(ids)) for role, ids in self.arguments)
+        return {key: values[key] for key in self.keys}
+
+
+class Document:
+    __slots__ = ('text', 'entities', 'events', 'keys', 'raw')
+
+    def __init__(self, text, entities, events, keys, raw=None):
+        self.text = text
+        self.entities = entities
+        self.events = events
+        self.keys = keys
+        # the json text of a file that doesn't follow the annotation format (kept as it is)
+        self.raw = raw
+
+    # A new dict, as read by json.load (the evaluator changes the lists it is given)
+    def to_dict(self):
+        if self.raw is not None:
+            return json.loads(self.raw)
+        values = {'text': self.text, 'entities': [entity.to_dict() for entity in self.entities], 'events': [event.to_dict() for event in self.events]}
+        return {key: values[key] for key in self.keys}
+
+    # The marshal-able form of the document (tuples of strings)
+    def to_tuple(self):
+        return (self.text, tuple((e.id, e.type, e.texts, e.keys) for e in self.entities), tuple((e.id, e.type, e.arguments, e.keys) for e in self.events), self.keys, self.raw)
+
+    @classmethod
+    def from_tuple(cls, values):
+        text, entities, events, keys, raw = values
+        return cls(text, tuple(Entity(*entity) for entity in entities), tuple(Event(*event) for event in events), keys, raw)
+
+
+def intern_keys(data):
+    return tuple(sys.intern(key) for key in data)
+
+
+def is_string(value):
+    return value is None or isinstance(value, str)
+
+
+def is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+# The Document of a parsed json file. The files that don't follow the annotation format (a prediction with other
+# keys or value types) are kept as json text, so to_dict always gives back what json.load gave.
+def make_document(data, json_text):
+    if not isinstance(data, dict) or not set(data) <= {'text', 'entities', 'events'} or not is_string(data.get('text')) \
+            or not isinstance(data.get('entities', []), list) or not isinstance(data.get('events', []), list):
+        return Document(None, (), (), (), json_text)
+    entities = []
+    for entity in data.get('entities', []):
+        if not isinstance(entity, dict) or not set(entity) <= {'id', 'type', 'texts'} or not is_string(entity.get('id')) \
+                or not is_string(entity.get('type')) or not (entity.get('texts') is None or is_string_list(entity['texts'])):
+            return Document(None, (), (), (), json_text)
+        texts = tuple(entity['texts']) if entity.get('texts') is not None else None
+        entities.append(Entity(intern_or_none(entity.get('id')), intern_or_none(entity.get('type')), texts, intern_keys(entity)))
+    events = []
+    for event in data.get('events', []):
+        if not isinstance(event, dict) or not is_string(event.get('id')) or not is_string(event.get('type')) \
+                or not all(is_string_list(ids) for role, ids in event.items() if role not in ('id', 'type')):
+            return Document(None, (), (), (), json_text)
+        arguments = tuple((sys.intern(role), tuple(sys.intern(entity_id) for entity_id in ids)) for role, ids in event.items() if role not in ('id', 'type'))
+        events.append(Event(intern_or_none(event.get('id')), intern_or_none(event.get('type')), arguments, intern_keys(event)))
+    return Document(data.get('text'), tuple(entities), tuple(events), intern_keys(data))
+
+
+def intern_or_none(value):
+    return sys.intern(value) if value is not None else None
+
+
+# Identifies the json files of the directory (name, size, mtime), so a cache is only used for the same files
+def directory_signature(directory):
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            stat = os.stat(os.path.join(directory, name))
+            files.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(files)
+
+
+def default_cache_path(directory):
+    return os.path.normpath(directory) + "_corpus.bin"
+
+
+class Corpus:
+    def __init__(self, directory, documents, signature):
+        self.directory = directory
+        # file name -> Document (the files that can't be read as json are missing)
+        self.documents = documents
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __getitem__(self, name):
+        return self.documents[name]
+
+    def get(self, name):
+        return self.documents.get(name)
+
+    @classmethod
+    def parse(cls, directory, signature=None):
+        signature = signature or directory_signature(directory)
+        documents = {}
+        for name, size, mtime in signature:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                json_text = f.read()
+            try:
+                data = json.loads(json_text)
+            except json.JSONDecodeError:
+                continue
+            documents[sys.intern(name)] = make_document(data, json_text)
+        return cls(directory, documents, signature)
+
+    def save(self, cache_path):
+        # written to a temporary file first, so an interrupted save doesn't leave a broken cache
+        temporary_path = cache_path + ".tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(marshal.dumps((CACHE_VERSION, self.signature, tuple((name, document.to_tuple()) for name, document in self.documents.items()))))
+        os.replace(temporary_path, cache_path)
+
+    # Returns None if the cache file is missing, broken, or was built for other files
+    @classmethod
+    def load_cache(cls, directory, cache_path, signature):
+        try:
+            with open(cache_path, 'rb') as f:
+                version, cached_signature, documents = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if version != CACHE_VERSION or cached_signature != signature:
+            return None
+        return cls(directory, {name: Document.from_tuple(values) for name, values in documents}, signature)
+
+
+_corpora = {}
+
+
+# Returns the corpus of the directory, read from its cache file if it was built for the same files, and parsed and
+# cached otherwise. The corpus is kept for lookup() until the directory changes.
+def load_directory(directory, cache_path=None):
+    cache_path = cache_path or default_cache_path(directory)
+    key = os.path.abspath(directory)
+    signature = directory_signature(directory)
+    corpus = _corpora.get(key)
+    if corpus is not None and corpus.signature == signature:
+        return corpus
+    corpus = Corpus.load_cache(directory, cache_path, signature)
+    if corpus is None:
+        corpus = Corpus.parse(directory, signature)
+        corpus.save(cache_path)
+    _corpora[key] = corpus
+    return corpus
+
+
+# For process pool initializers
+def load_directories(directories):
+    for directory in directories:
+        load_directory(directory)
+
+
+# The dict of a json file of a loaded corpus, None if its directory wasn't loaded (or the file can't be read as json)
+def lookup(file_path):
+    corpus = _corpora.get(os.path.dirname(os.path.abspath(file_path)))
+    if corpus is None:
+        return None
+    document = corpus.get(os.path.basename(file_path))
+    return document.to_dict() if document is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the binary cache of a directory of json files and compare the load times')
+    parser.add_argument('directory', type=str, help='Directory of gold or prediction json files')
+    parser.add_argument('--cache-path', type=str, default=None, help='Path of the cache file (default: <directory>_corpus.bin)')
+    args = parser.parse_args()
+    cache_path = args.cache_path or default_cache_path(args.directory)
+
+    start = time.perf_counter()
+    signature = directory_signature(args.directory)
+    dicts = {}
+    for name, size, mtime in signature:
+        with open(os.path.join(args.directory, name), 'r', encoding='utf-8') as f:
+            dicts[name] = json.load(f)
+    json_time = time.perf_counter() - start
+
+    corpus = Corpus.parse(args.directory, signature)
+    corpus.save(cache_path)
+    assert all(corpus[name].to_dict() == data for name, data in dicts.items() if name in corpus.documents)
+
+    start = time.perf_counter()
+    corpus = Corpus.load_cache(args.directory, cache_path, directory_signature(args.directory))
+    cache_time = time.perf_counter() - start
+    print(f"{len(corpus)} documents: json files {json_time * 1000:.1f}ms, cache {cache_time * 1000:.1f}ms ({os.path.getsize(cache_path)} bytes in {cache_path})")
+
+
+if __name__ == "__main__":
+    main()
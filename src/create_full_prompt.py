@@ -1,5 +1,16 @@
 import json, os
 import random
+import time
+from functools import lru_cache
+import streaming
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# the event types used for classification, in the order of the classification vector
+EVENT_TYPES = ["WillCreation", "Direction", "Bequest", "Nomination", "SignWill", "Attestation", "Authorization", "Revocation", "Excuse"]
 
 
 # open all the files in the directory and save them in a dict
@@ -18,22 +29,24 @@ def read_json_files(directory):
     return json_data
 
 
-# Loop through the list and sort by event type
+# Loop through the list and sort by event type. Each file is added to a bucket at most once, tracked by its filename.
 def make_example_pool(json_data):
     # define the event types
-    events = ["WillCreation", "Direction", "Bequest", "Nomination", "SignWill", "Attestation", "Authorization", "Revocation", "Excuse"]
+    events = set(EVENT_TYPES)
     sort_by_type = {}
+    sorted_ids = {}
     for k, v in json_data.items():
         event_sorted = False
         for e in v['events']:
-            for event in events:               
-                if e['type'] == event:    
-                    if event in sort_by_type and (k, v) not in sort_by_type[event]:
-                        event_sorted = True
-                        sort_by_type[event].append((k, v))
-                    elif event not in sort_by_type:
-                        event_sorted = True
-                        sort_by_type[event] = [(k, v)]
+            event = e['type']
+            if event in events:
+                event_sorted = True
+                if event not in sort_by_type:
+                    sort_by_type[event] = []
+                    sorted_ids[event] = set()
+                if k not in sorted_ids[event]:
+                    sorted_ids[event].add(k)
+                    sort_by_type[event].append((k, v))
         if event_sorted == False:
             if 'Etc' not in sort_by_type:
                 sort_by_type['Etc'] = [(k, v)]
@@ -42,10 +55,87 @@ def make_example_pool(json_data):
     return sort_by_type
 
 
+# The example pool of a directory, loaded once and indexed by event type. The pool is reloaded only when
+# the directory changes (its mtime, or the name, size or mtime of one of its json files).
+class ExamplePool:
+    def __init__(self, directory, check_interval=5.0):
+        self.directory = directory
+        # seconds between two checks of the directory, so that a run doesn't stat every file for each sentence
+        self.check_interval = check_interval
+        self.load()
+
+    def signature(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return os.stat(self.directory).st_mtime_ns, frozenset(files)
+
+    def load(self):
+        self.last_signature = self.signature()
+        self.last_check = time.monotonic()
+        self.json_data = read_json_files(self.directory)
+        self.by_type = make_example_pool(self.json_data)
+        # the buckets in filename order, for the prefix layout
+        self.canonical_by_type = {event: sorted(bucket, key=lambda example: example[0]) for event, bucket in self.by_type.items()}
+        # filename -> token count of the example, compact (used for the budget) and indented (what the unbudgeted prompt costs)
+        self.token_counts = {filename: count_tokens(compact_json(data)) for filename, data in self.json_data.items()}
+        self.indented_token_counts = {filename: count_tokens(json.dumps(data, indent=4)) for filename, data in self.json_data.items()}
+
+    def is_stale(self):
+        return self.signature() != self.last_signature
+
+    # The example as it is written in the prompts (indented, or compact for the budgeted prompts)
+    def example_text(self, filename, compact=False):
+        data = self.json_data[filename]
+        return compact_json(data) if compact else json.dumps(data, indent=4)
+
+    # The examples as they are written in a prompt, separated by ",\n"
+    def join_examples(self, filenames, compact=False):
+        return ',\n'.join(self.example_text(filename, compact) for filename in filenames)
+
+    def refresh(self):
+        if time.monotonic() - self.last_check < self.check_interval:
+            return False
+        self.last_check = time.monotonic()
+        if self.is_stale():
+            self.load()
+            return True
+        return False
+
+
+_example_pools = {}
+
+
+# Returns the ExamplePool of the directory, shared across the whole run. A file instead of a directory is read as a
+# packed example pool (see example_pack.py).
+def get_example_pool(directory):
+    # imported here, example_pack builds on this module
+    import example_pack
+    key = os.path.abspath(directory)
+    if key not in _example_pools:
+        _example_pools[key] = example_pack.PackedExamplePool(directory) if os.path.isfile(directory) else ExamplePool(directory)
+    else:
+        _example_pools[key].refresh()
+    return _example_pools[key]
+
+
+# the random generator of the example selection (the random module unless set_seed is called)
+example_rng = random
+
+
+# Makes the random example selection reproducible: the same seed selects the same examples in every run
+def set_seed(seed):
+    global example_rng
+    example_rng = random.Random(seed)
+
+
 # Method selecting a random number => use the example with the index as a demo (attach to a list and return the list)
 def select_random_example(example_pool, num_of_example):
     selected_examples = []
-    random_int = random.sample(range(0, len(example_pool)), int(num_of_example))
+    random_int = example_rng.sample(range(0, len(example_pool)), int(num_of_example))
     for i in random_int:
         random_example = example_pool[i]
         selected_examples.append(random_example)
@@ -53,7 +143,7 @@ def select_random_example(example_pool, num_of_example):
 
 
 def create_example_list(full_example_pool, classification, num_of_example):
-    events = ["WillCreation", "Direction", "Bequest", "Nomination", "SignWill", "Attestation", "Authorization", "Revocation", "Excuse"]
+    events = EVENT_TYPES
     example_list = []
     n = 0
     while n < len(classification):
@@ -69,8 +159,22 @@ def create_example_list(full_example_pool, classification, num_of_example):
     return example_list
 
 
-def create_full_prompt(example_list):
-    first_part = """Your task is to extract all instances of the following entities and events (including pronouns) from the will texts and output the extraction in JSON format.
+# The first num_of_example examples of each predicted event type in filename order (an example already used for
+# another type is skipped), so the same classification vector always gives the same examples in the same order
+def create_canonical_example_list(canonical_pool, classification, num_of_example):
+    example_list = []
+    chosen = set()
+    for n, label in enumerate(classification):
+        if label == 1:
+            selected_examples = [example for example in canonical_pool[EVENT_TYPES[n]] if example[0] not in chosen][:int(num_of_example)]
+            chosen.update(example[0] for example in selected_examples)
+            example_list += selected_examples
+    if len(example_list) == 0:
+        example_list += canonical_pool['Etc'][:int(num_of_example)]
+    return example_list
+
+
+PROMPT_INSTRUCTIONS = """Your task is to extract all instances of the following entities and events (including pronouns) from the will texts and output the extraction in JSON format.
 
 %entities: Testator, Beneficiary, Witness, State, County, Asset, Bond, Executor, Date, Time, Trustee, Will, Codicil, Debt, Expense, Tax, Duty, Right, Condition, Guardian, Trust, Conservator, Affidavit, NotaryPublic, NonBeneficiary
 %events: WillCreation, SignWill, Attestation, Revocation, Codicil, Bequest, Nomination, Disqualification, Renunciation, Death, Probate, Direction, Authorization, Excuse, Give, Notarization, NonProbateInstrumentCreation, Birth, Residual, Removal
@@ -78,19 +182,140 @@ def create_full_prompt(example_list):
 Here’s some examples of expected outputs in the desired format.
 
 """
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # the encoding files can't be downloaded (e.g. offline)
+        return None
+
+
+# Number of tokens of the text, with tiktoken if it is installed and ~4 characters per token otherwise
+def count_tokens(text):
+    encoding = get_encoding() if tiktoken is not None else None
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+# The examples without indentation and spaces, which take far fewer tokens than json.dumps(example, indent=4)
+def compact_json(example):
+    return json.dumps(example, ensure_ascii=False, separators=(',', ':'))
+
+
+# With the pool of the examples, the examples are written by the pool (a packed pool copies them from its file)
+def create_full_prompt(example_list, pool=None):
     example_ids = []
     prompt_examples = []
     for example in example_list:
         example_ids.append(example[0])
-        prompt_examples.append(json.dumps(example[1], indent=4))
-    full_demo = ',\n'.join(prompt_examples)
-    full_prompt = first_part + full_demo
+        if pool is None:
+            prompt_examples.append(json.dumps(example[1], indent=4))
+    full_demo = ',\n'.join(prompt_examples) if pool is None else pool.join_examples(example_ids)
+    full_prompt = PROMPT_INSTRUCTIONS + full_demo
     return full_prompt, example_ids
 
 
-def main(directory, classification=[1, 1, 1, 1, 1, 1, 1, 1, 1], num_of_example=1):
-    json_data = read_json_files(directory)
-    example_pool = make_example_pool(json_data)
-    example_list = create_example_list(example_pool, classification, num_of_example)
-    full_prompt, example_ids = create_full_prompt(example_list)
+# prompt tokens of the budgeted prompts and of the same examples indented, summed over the run
+token_savings = {"requests": 0, "prompt_tokens": 0, "indented_tokens": 0}
+
+
+# Builds the prompt from compact examples within max_tokens (instructions included). The examples are taken one per
+# predicted event type at a time (the first example of each type, then the second, ...), so every type gets an example
+# before any type gets a second one; an example that doesn't fit is skipped for a smaller one, and an example selected
+# for several types is used once. Token counts come from the pool (token_counts), so nothing is tokenized per request.
+def create_budgeted_prompt(example_list, token_counts, max_tokens, num_of_example=1, pool=None):
+    groups = [example_list[n:n + num_of_example] for n in range(0, len(example_list), num_of_example)]
+    # ",\n" between two examples is counted as one token
+    used = count_tokens(PROMPT_INSTRUCTIONS) - 1
+    chosen = set()
+    for rank in range(num_of_example):
+        for group in groups:
+            if rank >= len(group) or group[rank][0] in chosen:
+                continue
+            tokens = token_counts[group[rank][0]] + 1
+            if used + tokens <= max_tokens:
+                chosen.add(group[rank][0])
+                used += tokens
+    example_ids = []
+    prompt_examples = []
+    for example in example_list:
+        if example[0] in chosen and example[0] not in example_ids:
+            example_ids.append(example[0])
+            if pool is None:
+                prompt_examples.append(compact_json(example[1]))
+    full_prompt = PROMPT_INSTRUCTIONS + (',\n'.join(prompt_examples) if pool is None else pool.join_examples(example_ids, compact=True))
+    return full_prompt, example_ids, max(used, count_tokens(PROMPT_INSTRUCTIONS))
+
+
+# Prints the prompt tokens of a budgeted request next to what the unbudgeted prompt (all the selected examples, indented) would cost
+def report_prompt_tokens(prompt_tokens, indented_tokens, num_used, num_selected):
+    token_savings["requests"] += 1
+    token_savings["prompt_tokens"] += prompt_tokens
+    token_savings["indented_tokens"] += indented_tokens
+    saved = 1 - prompt_tokens / indented_tokens if indented_tokens > 0 else 0
+    print(f"prompt tokens: {prompt_tokens} instead of {indented_tokens} ({saved:.1%} saved, {num_used} of {num_selected} examples)")
+
+
+def report_token_savings():
+    if token_savings["requests"] == 0:
+        return
+    saved = token_savings["indented_tokens"] - token_savings["prompt_tokens"]
+    print(f"prompt tokens: {token_savings['prompt_tokens']} for {token_savings['requests']} requests, {saved} saved ({saved / token_savings['indented_tokens']:.1%}), {saved / token_savings['requests']:.0f} per request")
+
+
+# Characters of the prompts of the run, and how many of them are a prefix already sent in an earlier prompt. A prompt
+# seen before is shared as a whole; otherwise its common prefix with the previous prompt is counted (requests grouped
+# by classification vector are sent one after another, which is when a provider-side prefix cache can reuse them).
+prefix_sharing = {"requests": 0, "characters": 0, "shared_characters": 0, "previous": "", "seen": set()}
+
+
+def record_prompt(full_prompt):
+    prefix_sharing["requests"] += 1
+    prefix_sharing["characters"] += len(full_prompt)
+    # the hashes of the prompts are kept instead of the prompts themselves
+    if hash(full_prompt) in prefix_sharing["seen"]:
+        shared = len(full_prompt)
+    else:
+        shared = len(os.path.commonprefix([prefix_sharing["previous"], full_prompt]))
+        prefix_sharing["seen"].add(hash(full_prompt))
+    prefix_sharing["shared_characters"] += shared
+    prefix_sharing["previous"] = full_prompt
+
+
+def report_prefix_sharing():
+    if prefix_sharing["requests"] == 0:
+        return
+    ratio = prefix_sharing["shared_characters"] / prefix_sharing["characters"]
+    print(f"shared prompt prefix: {ratio:.1%} of {prefix_sharing['characters']} prompt characters ({len(prefix_sharing['seen'])} distinct prompts for {prefix_sharing['requests']} requests)")
+
+
+# Reorders (n, text, pred, ...) items chunk by chunk so that the texts with the same classification vector are sent
+# one after another (the prefix layout). The results are saved by index, so the order of the requests doesn't matter.
+def group_by_classification(items, chunk_size=1000):
+    for chunk in streaming.chunked(items, chunk_size):
+        chunk.sort(key=lambda item: tuple(item[2]))
+        yield from chunk
+
+
+# With max_tokens, the prompt is built by create_budgeted_prompt and its token savings are reported. An example_list
+# (e.g. retrieved by example_index.py) is used instead of the random examples. With the prefix layout, the examples are
+# the canonical ones of each predicted type, so the requests with the same classification vector get the same prompt.
+def main(directory, classification=[1, 1, 1, 1, 1, 1, 1, 1, 1], num_of_example=1, max_tokens=None, example_list=None, layout="random"):
+    pool = get_example_pool(directory)
+    if example_list is None and layout == "prefix":
+        example_list = create_canonical_example_list(pool.canonical_by_type, classification, num_of_example)
+    elif example_list is None:
+        example_list = create_example_list(pool.by_type, classification, num_of_example)
+    if max_tokens is None:
+        full_prompt, example_ids = create_full_prompt(example_list, pool)
+        record_prompt(full_prompt)
+        return full_prompt
+    full_prompt, example_ids, prompt_tokens = create_budgeted_prompt(example_list, pool.token_counts, max_tokens, int(num_of_example), pool)
+    indented_tokens = count_tokens(PROMPT_INSTRUCTIONS) + sum(pool.indented_token_counts[example[0]] + 1 for example in example_list) - 1
+    report_prompt_tokens(prompt_tokens, indented_tokens, len(example_ids), len(example_list))
+    record_prompt(full_prompt)
     return full_prompt
\ No newline at end of file
@@ -0,0 +1,116 @@
+import hashlib
+import re
+
+"""
+This program sends each distinct clause to the LLM once. Will corpora repeat the same boilerplate clauses with only the anonymization placeholders changing (`[Person-1]`, `[Address-2]`, ...), so the placeholders are renumbered in order of appearance, the whitespace is collapsed, and the result is hashed. The first text of each clause is processed as usual; its extraction is then saved for every other text of the same clause, with the placeholders of the extraction renamed to the ones of that text.
+"""
+
+PLACEHOLDER_PATTERN = re.compile(r"\[([A-Za-z]+)-(\d+)\]")
+
+
+# Returns the normalized text and its placeholders in order of first appearance. The n-th distinct placeholder of
+# a type is renamed [Type-n], so texts that only differ by their placeholder numbers get the same normalized text.
+def normalize(text):
+    placeholders = []
+    canonical = {}
+    counts = {}
+
+    def rename(match):
+        placeholder = match.group(0)
+        if placeholder not in canonical:
+            counts[match.group(1)] = counts.get(match.group(1), 0) + 1
+            canonical[placeholder] = "[" + match.group(1) + "-" + str(counts[match.group(1)]) + "]"
+            placeholders.append(placeholder)
+        return canonical[placeholder]
+
+    return " ".join(PLACEHOLDER_PATTERN.sub(rename, text).split()), placeholders
+
+
+# extra holds anything else the result depends on (e.g. the classification vector given to the extraction)
+def clause_key(text, extra=()):
+    normalized, placeholders = normalize(text)
+    key = hashlib.sha256((normalized + "\n" + repr(extra)).encode('utf-8')).hexdigest()
+    return key, placeholders
+
+
+# Renames the placeholders of a response: the n-th placeholder of the representative text becomes the n-th placeholder
+# of the duplicate (both lists come from normalize, so they have the same length and types)
+def remap_placeholders(response, from_placeholders, to_placeholders):
+    mapping = dict(zip(from_placeholders, to_placeholders))
+    return PLACEHOLDER_PATTERN.sub(lambda match: mapping.get(match.group(0), match.group(0)), response)
+
+
+class Deduplicator:
+    def __init__(self):
+        # key -> (placeholders of the representative, response) of the clauses already answered
+        self.responses = {}
+        # key -> (index, placeholders) of the representative still being processed, and index -> key
+        self.representatives = {}
+        self.pending_keys = {}
+        # index of a representative -> [(index, placeholders)] of its duplicates
+        self.duplicates = {}
+        self.num_texts = 0
+        self.num_duplicates = 0
+
+    # Yields the (n, text, ...) items of the texts to process, the first text of each clause. The duplicates of a clause
+    # already answered are saved with the writer right away; the others are saved when their representative is.
+    def filter(self, items, writer):
+        for item in items:
+            n, text = item[0], item[1]
+            key, placeholders = clause_key(text, tuple(tuple(part) for part in item[2:]))
+            self.num_texts += 1
+            if key in self.responses:
+                self.num_duplicates += 1
+                representative_placeholders, response = self.responses[key]
+                writer.write(n, remap_placeholders(response, representative_placeholders, placeholders))
+            elif key in self.representatives:
+                self.num_duplicates += 1
+                self.duplicates[self.representatives[key][0]].append((n, placeholders))
+            else:
+                self.representatives[key] = (n, placeholders)
+                self.pending_keys[n] = key
+                self.duplicates[n] = []
+                yield item
+
+    # Called when the response of a text is saved: the response is kept for the later duplicates of its clause, and
+    # saved for the duplicates already seen
+    def fan_out(self, index, response, writer):
+        key = self.pending_keys.pop(index, None)
+        if key is None:
+            return
+        n, placeholders = self.representatives.pop(key)
+        self.responses[key] = (placeholders, response)
+        for duplicate, duplicate_placeholders in self.duplicates.pop(index):
+            writer.write(duplicate, remap_placeholders(response, placeholders, duplicate_placeholders))
+
+    # Called when a text failed: its duplicates already seen fail with it, the later ones are sent again
+    def fail_out(self, index, stage, error, writer):
+        key = self.pending_keys.pop(index, None)
+        if key is None:
+            return
+        del self.representatives[key]
+        for duplicate, duplicate_placeholders in self.duplicates.pop(index):
+            writer.fail(duplicate, stage, error)
+
+    def report(self):
+        if self.num_texts == 0:
+            return
+        print(f"dedup: {self.num_duplicates} of {self.num_texts} texts were duplicates of an earlier clause ({self.num_duplicates} extraction calls saved)")
+
+
+# A ResultWriter that also saves each response for the duplicates of its text
+class DedupWriter:
+    def __init__(self, writer, deduplicator):
+        self.writer = writer
+        self.deduplicator = deduplicator
+
+    def write(self, index, response):
+        self.writer.write(index, response)
+        self.deduplicator.fan_out(index, response, self.writer)
+
+    def fail(self, index, stage, error):
+        self.writer.fail(index, stage, error)
+        self.deduplicator.fail_out(index, stage, error, self.writer)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
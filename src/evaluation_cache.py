@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+"""
+This program keeps the TP/FP/FN counts of every gold/prediction file pair scored by `auto_evaluator.py`, so that evaluating a prediction directory again only scores the pairs whose files changed. The counts are stored in a SQLite file, keyed by the content hashes of the two files, the similarity threshold, the matching and a hash of the evaluator's code (a change to `auto_evaluator.py`, `similarity.py` or `corpus.py` scores everything again). The hash of a file is only recomputed when its size or modification time changes. To use it, run the following code:
+```
+python auto_evaluator.py path/to/your/gold_files path/to/your/pred_files path/to/your/output "gold_file_name" "pred_file_name" --cache path/to/evaluation_cache.sqlite
+```
+"""
+
+# corpus.py gives the evaluator its dicts with --corpus-cache (Document.to_dict)
+EVALUATOR_FILES = ["auto_evaluator.py", "similarity.py", "corpus.py"]
+# counts stored between two commits, so an interrupted run keeps what it scored
+COMMIT_EVERY = 32
+
+
+# Hash of the code the counts depend on
+def evaluator_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in EVALUATOR_FILES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class EvaluationCache:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.version = evaluator_version()
+        self.hits = 0
+        self.misses = 0
+        self.uncommitted = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS counts (key TEXT PRIMARY KEY, counts TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)")
+        self.connection.commit()
+
+    # The sha256 of the file, read again only if its size or modification time changed since it was last hashed
+    def file_hash(self, file_path):
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        row = self.connection.execute("SELECT size, mtime_ns, hash FROM file_hashes WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        with open(path, 'rb') as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        self.connection.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                                (path, stat.st_size, stat.st_mtime_ns, file_hash))
+        return file_hash
+
+    # None when one of the files is missing (the pair is scored, and fails, as without the cache)
+    def make_key(self, gold_file, prediction_file, threshold, matching):
+        if not os.path.exists(gold_file) or not os.path.exists(prediction_file):
+            return None
+        parts = [self.file_hash(gold_file), self.file_hash(prediction_file), repr(float(threshold)), matching, self.version]
+        return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+
+    # The (entity TP, FP, FN, event TP, FP, FN) counts of the pair, None if it wasn't scored yet
+    def get(self, key):
+        row = self.connection.execute("SELECT counts FROM counts WHERE key = ?", (key,)).fetchone() if key is not None else None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, counts):
+        if key is not None:
+            self.connection.execute("INSERT OR REPLACE INTO counts (key, counts) VALUES (?, ?)", (key, json.dumps(list(counts))))
+            self.uncommitted += 1
+            if self.uncommitted >= COMMIT_EVERY:
+                self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def report(self):
+        print(f"evaluation cache: {self.hits} file pairs reused, {self.misses} scored")
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def open_cache(path):
+    if path is None:
+        return None
+    return EvaluationCache(path)
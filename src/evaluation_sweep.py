@@ -0,0 +1,109 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+import auto_evaluator
+import corpus
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""
+This program evaluates several prediction directories at several similarity thresholds in one pass. The matching of each gold/prediction file pair (the expensive part of `auto_evaluator.py`) is done once, and the TP/FP/FN counts are then derived from the same similarity data for every threshold. The rows of every run and threshold (one per file pair, and a total row per run and threshold with empty Gold and Prediction columns, like `evaluation_result.csv`) are written to one table, in Parquet format if the output file ends with `.parquet` (requires `pyarrow`) and in csv format otherwise. To run the program, run the following code:
+```
+python evaluation_sweep.py path/to/your/gold_files "gold_file_name" path/to/sweep.csv --pred path/to/run1 "pred_file_name" --pred path/to/run2 "pred_file_name" --thresholds 0.5 0.6 0.7 0.8 0.9
+```
+"""
+
+COLUMNS = ['Run', 'Threshold'] + ['Gold', 'Prediction', 'Entity_TP', 'Entity_FP', 'Entity_FN', 'Event_TP', 'Event_FP', 'Event_FN', 'Entity_Precision', 'Entity_Recall', 'Entity_F1', 'Event_Precision', 'Event_Recall', 'Event_F1']
+
+
+# Wrapper for the process pool (the arguments are packed in one tuple)
+def score_file_pair_args(args):
+    return auto_evaluator.score_file_pair(*args)
+
+
+# Returns, for each run (prediction path, prediction file name), the (gold file, prediction file, scores) of its file pairs in file order
+# With corpus_cache, the directories are read from their binary corpus files (see corpus.py).
+def score_runs(gold_path, gold_file_name, runs, workers=1, matching="greedy", corpus_cache=False):
+    num_files = len(auto_evaluator.get_json_files(gold_path))
+    directories = [gold_path] + [prediction_path for prediction_path, prediction_file_name in runs] if corpus_cache else []
+    corpus.load_directories(directories)
+    pair_args = []
+    for prediction_path, prediction_file_name in runs:
+        # sanity check - check if there are same number of gold files and prediction files
+        assert len(auto_evaluator.get_json_files(prediction_path)) == num_files
+        pair_args += [(gold_path, prediction_path, gold_file_name, prediction_file_name, n, matching) for n in range(num_files)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=corpus.load_directories, initargs=(directories,)) as executor:
+            scored = list(executor.map(score_file_pair_args, pair_args, chunksize=max(1, len(pair_args) // (workers * 4))))
+    else:
+        scored = [auto_evaluator.score_file_pair(*args) for args in pair_args]
+    return [scored[n * num_files:(n + 1) * num_files] for n in range(len(runs))]
+
+
+# The rows of a run at a threshold: one per file pair and the total row, as in evaluation_result.csv
+def threshold_rows(scored_pairs, similarity_threshold):
+    rows = []
+    sums = [0] * 6
+    for golden_file, prediction_file, scores in scored_pairs:
+        counts = auto_evaluator.count_matches(scores, similarity_threshold)
+        sums = [total + count for total, count in zip(sums, counts)]
+        rows.append(auto_evaluator.make_row(golden_file, prediction_file, counts))
+    rows.append(["", ""] + sums + list(auto_evaluator.get_precision_recall_f1(*sums)))
+    return rows
+
+
+def sweep(gold_path, gold_file_name, runs, thresholds, workers=1, matching="greedy", corpus_cache=False):
+    table = []
+    for (prediction_path, prediction_file_name), scored_pairs in zip(runs, score_runs(gold_path, gold_file_name, runs, workers, matching, corpus_cache)):
+        for similarity_threshold in thresholds:
+            for row in threshold_rows(scored_pairs, similarity_threshold):
+                table.append([os.path.join(prediction_path, prediction_file_name), similarity_threshold] + row)
+    return table
+
+
+def write_table(table, output_file):
+    if output_file.endswith(".parquet"):
+        if pyarrow is None:
+            raise ValueError("writing Parquet files requires pyarrow, use a .csv output file or install pyarrow")
+        columns = {name: [row[n] for row in table] for n, name in enumerate(COLUMNS)}
+        pyarrow.parquet.write_table(pyarrow.table(columns), output_file)
+        return
+    with open(output_file, 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(COLUMNS)
+        csv_writer.writerows(table)
+
+
+# Prints the total F1 scores of every run and threshold
+def print_summary(table):
+    for row in table:
+        if row[2] == "":
+            print(f"{row[0]} @ {row[1]}: entity F1 {row[12]:.4f}, event F1 {row[15]:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate several prediction directories at several similarity thresholds, matching each file pair once')
+    parser.add_argument('gold_path', type=str, help='Path to the gold files')
+    parser.add_argument('gold_name', type=str, help='Name of the gold files')
+    parser.add_argument('output_file', type=str, help='Combined table (.csv, or .parquet with pyarrow)')
+    parser.add_argument('--pred', nargs=2, action='append', required=True, metavar=('PRED_PATH', 'PRED_NAME'), help='Path and name of the prediction files of a run (repeat for several runs)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.7], help='Similarity thresholds to evaluate')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes scoring the file pairs in parallel')
+    parser.add_argument('--matching', type=str, default='greedy', choices=['greedy', 'hungarian'], help='How the entities and events are paired before scoring')
+    parser.add_argument('--corpus-cache', action='store_true', help='Read the gold and prediction directories from their binary corpus files (see corpus.py)')
+    args = parser.parse_args()
+    if args.output_file.endswith(".parquet") and pyarrow is None:
+        parser.error("writing Parquet files requires pyarrow, use a .csv output file or install pyarrow")
+
+    table = sweep(args.gold_path, args.gold_name, [tuple(run) for run in args.pred], args.thresholds, args.workers, args.matching, args.corpus_cache)
+    write_table(table, args.output_file)
+    print_summary(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import zlib
+import numpy as np
+import create_full_prompt
+import streaming
+
+"""
+This program selects the prompt examples by similarity to the will text instead of at random. The texts of the example pool are turned into hashed word unigram and bigram vectors (sublinear tf-idf, L2-normalized) and stored as the rows of a NumPy matrix, so a batch of will texts is scored against every example with one matrix product, and the top-k examples of each predicted event type are read from the scores. The index is saved next to the example pool (`<directory>_index.npz`) and loaded instead of rebuilt as long as the json files of the pool don't change. To build the index and show the examples retrieved for the first texts of a csv file, run the following code:
+```
+python example_index.py ../data/example_pool ../data/dev.csv --top-k 2
+```
+"""
+
+NUM_FEATURES = 1 << 14
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [words[n] + " " + words[n + 1] for n in range(len(words) - 1)]
+
+
+# crc32 is used instead of hash() so that the features are the same in every process (the index is saved to disk)
+def feature_counts(text):
+    counts = {}
+    for token in tokenize(text):
+        feature = zlib.crc32(token.encode('utf-8')) % NUM_FEATURES
+        counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+
+# Rows of sublinear term frequencies (1 + log(count)), one row per text
+def term_frequencies(texts):
+    matrix = np.zeros((len(texts), NUM_FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in feature_counts(text).items():
+            matrix[row, feature] = 1 + math.log(count)
+    return matrix
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+# Identifies the json files of the pool (name, size, mtime), so a saved index is only reused for the same files
+def pool_signature(example_pool):
+    files = sorted(example_pool.last_signature[1])
+    return hashlib.sha256(json.dumps(files).encode('utf-8')).hexdigest()
+
+
+class ExampleIndex:
+    def __init__(self, filenames, matrix, idf, signature):
+        self.filenames = filenames
+        self.matrix = matrix
+        self.idf = idf
+        self.signature = signature
+        self.rows = {filename: row for row, filename in enumerate(filenames)}
+
+    @classmethod
+    def build(cls, example_pool):
+        filenames = list(example_pool.json_data)
+        frequencies = term_frequencies([example_pool.json_data[filename]['text'] for filename in filenames])
+        document_frequencies = np.count_nonzero(frequencies, axis=0)
+        idf = (np.log((1 + len(filenames)) / (1 + document_frequencies)) + 1).astype(np.float32)
+        return cls(filenames, normalize_rows(frequencies * idf), idf, pool_signature(example_pool))
+
+    def save(self, index_path):
+        # written to a temporary file first, so an interrupted save doesn't leave a broken index
+        temporary_path = index_path + ".tmp"
+        with open(temporary_path, 'wb') as f:
+            np.savez_compressed(f, filenames=np.array(self.filenames), matrix=self.matrix, idf=self.idf, signature=np.array(self.signature))
+        os.replace(temporary_path, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as data:
+            return cls([str(filename) for filename in data['filenames']], data['matrix'], data['idf'], str(data['signature']))
+
+    def vectorize(self, texts):
+        return normalize_rows(term_frequencies(texts) * self.idf)
+
+    # Cosine similarity of every text with every example (one row per text, one column per example)
+    def scores(self, texts):
+        return self.vectorize(texts) @ self.matrix.T
+
+    # The num_of_example most similar examples of the bucket that are not in exclude, ties going to the earlier example of the bucket
+    def top_k(self, text_scores, bucket, num_of_example, exclude=()):
+        bucket_scores = text_scores[[self.rows[filename] for filename, data in bucket]]
+        order = np.argsort(-bucket_scores, kind='stable')
+        return [bucket[n] for n in order if bucket[n][0] not in exclude][:num_of_example]
+
+    # The example lists of a batch of texts: the same event types as create_example_list (the Etc examples
+    # when no type is predicted), with the most similar examples of each type instead of random ones. An example
+    # already retrieved for another type is not repeated, the next most similar one is taken instead.
+    def retrieve_batch(self, example_pool, texts, classifications, num_of_example):
+        num_of_example = int(num_of_example)
+        example_lists = []
+        if len(texts) == 0:
+            return example_lists
+        for text_scores, classification in zip(self.scores(texts), classifications):
+            example_list = []
+            for n, label in enumerate(classification):
+                if label == 1:
+                    chosen = set(filename for filename, data in example_list)
+                    example_list += self.top_k(text_scores, example_pool[create_full_prompt.EVENT_TYPES[n]], num_of_example, chosen)
+            if len(example_list) == 0:
+                example_list += self.top_k(text_scores, example_pool['Etc'], num_of_example)
+            example_lists.append(example_list)
+        return example_lists
+
+
+_example_indexes = {}
+
+
+def default_index_path(directory):
+    return os.path.normpath(directory) + "_index.npz"
+
+
+# Returns the index of the example pool directory, loaded from index_path if it was built for the same files, and
+# built and saved otherwise. The index is rebuilt when the example pool is reloaded.
+def get_example_index(directory, index_path=None):
+    example_pool = create_full_prompt.get_example_pool(directory)
+    index_path = index_path or default_index_path(directory)
+    key = os.path.abspath(directory)
+    signature = pool_signature(example_pool)
+    index = _example_indexes.get(key)
+    if index is not None and index.signature == signature:
+        return index
+    if os.path.exists(index_path):
+        index = ExampleIndex.load(index_path)
+    if index is None or index.signature != signature:
+        index = ExampleIndex.build(example_pool)
+        index.save(index_path)
+    _example_indexes[key] = index
+    return index
+
+
+# Adds the retrieved example list to each (n, text, pred) item, querying the index one batch of texts at a time.
+# Without an index, the example list is None (random examples are selected by create_full_prompt.main).
+def attach_examples(items, directory, num_of_example, index=None, batch_size=256):
+    for batch in streaming.chunked(items, batch_size):
+        if index is None:
+            example_lists = [None] * len(batch)
+        else:
+            by_type = create_full_prompt.get_example_pool(directory).by_type
+            example_lists = index.retrieve_batch(by_type, [text for n, text, pred in batch], [pred for n, text, pred in batch], num_of_example)
+        for (n, text, pred), example_list in zip(batch, example_lists):
+            yield n, text, pred, example_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the example index and show the retrieved examples')
+    parser.add_argument('example_pool', type=str, help='Path to the example pool directory')
+    parser.add_argument('input_file', type=str, help='Csv file with the will texts and their labels')
+    parser.add_argument('--index-path', type=str, default=None, help='Path of the saved index (default: <example_pool>_index.npz)')
+    parser.add_argument('--top-k', type=int, default=1, help='Number of examples per event type')
+    parser.add_argument('--num-texts', type=int, default=5, help='Number of texts to show')
+    args = parser.parse_args()
+
+    index = get_example_index(args.example_pool, args.index_path)
+    records = [record for record, _ in zip(streaming.iter_csv(args.input_file), range(args.num_texts))]
+    by_type = create_full_prompt.get_example_pool(args.example_pool).by_type
+    example_lists = index.retrieve_batch(by_type, [record.text for record in records], [record.labels for record in records], args.top_k)
+    for record, example_list in zip(records, example_lists):
+        print(record.text[:100])
+        for filename, data in example_list:
+            print("    " + filename + ": " + data['text'][:80])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections.abc import Mapping
+import create_full_prompt
+
+"""
+This program packs an example pool directory into one file, so that a run opens one file instead of every json file of the pool (slow on network filesystems for large pools). The pack holds a header (file names, event type buckets, token counts), an offset table, and every example already serialized the two ways the prompts use it (indented, and compact for `--max-prompt-tokens`). At run time the pack is memory-mapped: the prompts are built by copying the examples' bytes out of the map, nothing is parsed, and processes running on the same machine share the pages of the file. To pack a pool, run the following code:
+```
+python example_pack.py ../data/example_pool ../data/example_pool.pack
+```
+and give the pack instead of the directory to `main.py` (`--examples ../data/example_pool.pack`). The pack is a snapshot: pack the directory again after changing its files.
+"""
+
+MAGIC = b"PC4WPACK"
+VERSION = 1
+# magic, version, number of examples, header length
+PREAMBLE = struct.Struct("<8sIIQ")
+# per example: offset and length of the indented json, offset and length of the compact json
+OFFSET_FIELDS = 4
+
+
+def pack(directory, pack_path):
+    pool = create_full_prompt.ExamplePool(directory)
+    filenames = list(pool.json_data)
+    positions = {filename: n for n, filename in enumerate(filenames)}
+    offsets = array('Q')
+    payload = bytearray()
+    for filename in filenames:
+        for compact in (False, True):
+            data = pool.example_text(filename, compact).encode('utf-8')
+            offsets.extend([len(payload), len(data)])
+            payload += data
+    header = json.dumps({
+        "filenames": filenames,
+        # the buckets in the order of the directory pool, so the random selection picks the same examples
+        "by_type": {event: [positions[filename] for filename, data in bucket] for event, bucket in pool.by_type.items()},
+        "token_counts": [pool.token_counts[filename] for filename in filenames],
+        "indented_token_counts": [pool.indented_token_counts[filename] for filename in filenames],
+        "signature": sorted(pool.last_signature[1]),
+        "directory_mtime": pool.last_signature[0],
+    }, ensure_ascii=False).encode('utf-8')
+    # written to a temporary file first, so an interrupted pack doesn't leave a broken file
+    temporary_path = pack_path + ".tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(filenames), len(header)))
+        f.write(header)
+        f.write(offsets.tobytes())
+        f.write(payload)
+    os.replace(temporary_path, pack_path)
+    return len(filenames)
+
+
+# An example of a packed pool, parsed from its compact json the first time one of its fields is read
+class LazyExample(Mapping):
+    __slots__ = ('pool', 'position', 'data')
+
+    def __init__(self, pool, position):
+        self.pool = pool
+        self.position = position
+        self.data = None
+
+    def load(self):
+        if self.data is None:
+            self.data = json.loads(bytes(self.pool.example_bytes(self.position, compact=True)))
+        return self.data
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+
+# The same attributes as an ExamplePool (by_type, canonical_by_type, json_data, token counts), read from a pack file
+class PackedExamplePool(create_full_prompt.ExamplePool):
+    def pack_signature(self):
+        stat = os.stat(self.directory)
+        return stat.st_size, stat.st_mtime_ns
+
+    def load(self):
+        self.last_check = time.monotonic()
+        self.last_pack_signature = self.pack_signature()
+        with open(self.directory, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_examples, header_length = PREAMBLE.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(self.directory + " is not an example pool pack (or was packed by another version), pack the directory again")
+        header_end = PREAMBLE.size + header_length
+        header = json.loads(self.map[PREAMBLE.size:header_end])
+        self.offsets = array('Q')
+        self.offsets.frombytes(self.map[header_end:header_end + num_examples * OFFSET_FIELDS * self.offsets.itemsize])
+        self.payload = memoryview(self.map)[header_end + len(self.offsets) * self.offsets.itemsize:]
+
+        self.filenames = header["filenames"]
+        self.positions = {filename: n for n, filename in enumerate(self.filenames)}
+        self.json_data = {filename: LazyExample(self, n) for n, filename in enumerate(self.filenames)}
+        self.by_type = {event: [(self.filenames[n], self.json_data[self.filenames[n]]) for n in positions] for event, positions in header["by_type"].items()}
+        self.canonical_by_type = {event: sorted(bucket, key=lambda example: example[0]) for event, bucket in self.by_type.items()}
+        self.token_counts = dict(zip(self.filenames, header["token_counts"]))
+        self.indented_token_counts = dict(zip(self.filenames, header["indented_token_counts"]))
+        # the signature of the packed directory, so an example index built from the directory is reused (see example_index.py)
+        self.last_signature = (header["directory_mtime"], frozenset(tuple(file) for file in header["signature"]))
+
+    def is_stale(self):
+        return self.pack_signature() != self.last_pack_signature
+
+    def example_bytes(self, position, compact=False):
+        offset, length = self.offsets[4 * position + 2 * compact], self.offsets[4 * position + 2 * compact + 1]
+        return self.payload[offset:offset + length]
+
+    def example_text(self, filename, compact=False):
+        return str(self.example_bytes(self.positions[filename], compact), 'utf-8')
+
+    # The bytes of the examples are joined straight from the map and decoded once
+    def join_examples(self, filenames, compact=False):
+        return b',\n'.join(self.example_bytes(self.positions[filename], compact) for filename in filenames).decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack an example pool directory into one memory-mapped file')
+    parser.add_argument('directory', type=str, help='Path to the example pool directory')
+    parser.add_argument('pack_path', type=str, help='Path of the pack file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_examples = pack(args.directory, args.pack_path)
+    print(f"packed {num_examples} examples into {args.pack_path} ({os.path.getsize(args.pack_path)} bytes) in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    create_full_prompt.ExamplePool(args.directory)
+    directory_time = time.perf_counter() - start
+    start = time.perf_counter()
+    PackedExamplePool(args.pack_path)
+    print(f"load: directory {directory_time * 1000:.1f}ms, pack {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,18 @@
 import os
 import csv
-import create_full_prompt
-from setfit import SetFitModel
-from openai import OpenAI
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_random_exponential,
-)  # for exponential backoff
+import time
 
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
-def extract_information(prompt, target_text, model_name, client):
-    response = client.chat.completions.create(
-        model=model_name,
-        response_format={
-            'type': 'json_object',
-        },
-        messages=[
-            {
-                "role": "system",
-                "content": prompt
-            },
-            {
-                "role": "user",
-                "content": target_text
-            }
-        ],
-        temperature=0,
-        max_tokens=4096,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-    )
-    return response
-
-
-def main(text_list):
-    # prompt the user to choose model
-    model_name = input("Please choose the model (gpt-4-1106-preview or gpt-4o-mini-2024-07-18): ")
-
-    # ask the user for the directory and num_of_examples (used for prompt creation)
-    directory = input("Please provide the path to the prompt examples: ")
-    num_of_examples = input("How many examples do you want to use for each event type? ")
-    full_prompt = create_full_prompt.main(directory, [1, 1, 1, 1, 1, 1, 1, 1, 1], num_of_examples)
-
-    if model_name in ['gpt-4-1106-preview', 'gpt-4o-mini-2024-07-18']:
-        # prompt the user for their api key
-        key = input("Please enter your openai api key: ")
-        client = OpenAI(api_key=key)
-        # extract information from the will texts
-        extracted_info = []
-        n = 0
-        while n < len(text_list):
-            print("processing " + str(n+1) + "th sentence!")
-            try:
-                response = extract_information(full_prompt, text_list[n], model_name, client)
-                extracted_info.append(response.choices[0].message.content)
-                n += 1
-            except:
-                print("something went wrong while processing " + str(n) + "th text!")
-                return extracted_info
-        return extracted_info
-    else:
-        print("Please choose between gpt-4-1106-preview and gpt-4o-mini-2024-07-18!")
+# text_list can be any iterable (e.g. a csv file read row by row). The texts are extracted with the settings,
+# the client and the extraction stage of the pipeline (see pipeline.py), all with the same prompt (every event type).
+# With a writer (see result_writer.py), each result is saved as soon as it is received, the texts already in the
+# writer's manifest are skipped, failed texts are skipped instead of ending the run, and the number of saved results is returned.
+def run(pipeline, text_list, writer=None):
+    full_prompt = pipeline.prompt([1, 1, 1, 1, 1, 1, 1, 1, 1])
+    writer = pipeline.wrap_writer(writer)
+    pending = pipeline.pending(pipeline.rows(text_list), writer)
+    start = time.perf_counter()
+    # extract information from the will texts
+    extracted_info = pipeline.extract(((n, text, full_prompt) for n, text in pending), writer)
+    pipeline.report(writer.written if writer is not None else len(extracted_info), start, prefix_sharing=False)
+    return extracted_info
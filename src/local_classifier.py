@@ -0,0 +1,134 @@
+import argparse
+import csv
+import os
+import pickle
+import time
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.multiclass import OneVsRestClassifier
+
+"""
+This program trains a local (CPU-only) classifier for the first step of the prompt chain, so that the will texts can be classified without an LLM round-trip. The classifier is a TF-IDF + logistic regression model trained on the label columns of the csv files (will_creation ... excuse), and it outputs the same 9-dim label vectors as the LLM classification. To train and save a model, run the following code:
+```
+python local_classifier.py train path/to/model.pkl ../data/dev.csv
+```
+To check its accuracy and speed on another file, run the following code:
+```
+python local_classifier.py evaluate path/to/model.pkl ../data/test.csv
+```
+"""
+
+LABEL_COLUMNS = ["will_creation", "direction", "bequest", "nomination", "sign_will", "attestation", "authorization", "revocation", "excuse"]
+
+
+def read_labeled_csv(csv_paths):
+    texts = []
+    labels = []
+    for csv_path in csv_paths:
+        with open(csv_path, 'r') as csvfile:
+            for row in csv.DictReader(csvfile):
+                texts.append(row['text'])
+                labels.append([int(row[column]) for column in LABEL_COLUMNS])
+    return texts, labels
+
+
+class LocalClassifier:
+    def __init__(self):
+        self.vectorizer = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=1)
+        self.model = OneVsRestClassifier(LogisticRegression(max_iter=1000, class_weight='balanced'))
+        # labels that are constant in the training data are predicted as that constant
+        self.constant_labels = {}
+
+    def train(self, texts, labels):
+        features = self.vectorizer.fit_transform(texts)
+        self.constant_labels = {}
+        for n in range(len(LABEL_COLUMNS)):
+            values = set(row[n] for row in labels)
+            if len(values) == 1:
+                self.constant_labels[n] = values.pop()
+        self.model.fit(features, labels)
+        return self
+
+    # Classifies the whole list at once (one sparse matrix product per label)
+    def predict(self, text_list):
+        if len(text_list) == 0:
+            return []
+        predictions = self.model.predict(self.vectorizer.transform(text_list)).tolist()
+        for row in predictions:
+            for n, value in self.constant_labels.items():
+                row[n] = value
+        return [[int(label) for label in row] for row in predictions]
+
+    def save(self, model_path):
+        directory = os.path.dirname(model_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # the fitted components are saved instead of the object, so the file loads no matter which module saved it
+        with open(model_path, 'wb') as f:
+            pickle.dump({"vectorizer": self.vectorizer, "model": self.model, "constant_labels": self.constant_labels}, f)
+
+    @classmethod
+    def load(cls, model_path):
+        with open(model_path, 'rb') as f:
+            components = pickle.load(f)
+        classifier = cls()
+        classifier.vectorizer = components["vectorizer"]
+        classifier.model = components["model"]
+        classifier.constant_labels = components["constant_labels"]
+        return classifier
+
+
+# SetFit models are saved as directories, the TF-IDF model as a pickle file
+class SetFitClassifier:
+    def __init__(self, model_path):
+        from setfit import SetFitModel
+        self.model = SetFitModel.from_pretrained(model_path)
+
+    def predict(self, text_list):
+        if len(text_list) == 0:
+            return []
+        return [[int(label) for label in row] for row in self.model.predict(text_list).tolist()]
+
+
+def load_classifier(model_path):
+    if os.path.isdir(model_path):
+        return SetFitClassifier(model_path)
+    return LocalClassifier.load(model_path)
+
+
+def evaluate(classifier, texts, labels):
+    start = time.perf_counter()
+    preds = classifier.predict(texts)
+    elapsed = time.perf_counter() - start
+    exact = sum(1 for pred, gold in zip(preds, labels) if pred == gold)
+    print(f"classified {len(texts)} texts in {elapsed:.3f}s ({len(texts) / elapsed if elapsed > 0 else 0:.0f} texts/sec)")
+    print(f"exact match: {exact / len(texts):.3f}")
+    for n, column in enumerate(LABEL_COLUMNS):
+        tp = sum(1 for pred, gold in zip(preds, labels) if pred[n] == 1 and gold[n] == 1)
+        fp = sum(1 for pred, gold in zip(preds, labels) if pred[n] == 1 and gold[n] == 0)
+        fn = sum(1 for pred, gold in zip(preds, labels) if pred[n] == 0 and gold[n] == 1)
+        precision = tp / (tp + fp) if tp + fp > 0 else 0
+        recall = tp / (tp + fn) if tp + fn > 0 else 0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0
+        print(f"{column:>15}: precision {precision:.3f} recall {recall:.3f} f1 {f1:.3f}")
+    return preds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train or evaluate the local classifier')
+    parser.add_argument('command', type=str, choices=['train', 'evaluate'], help='train a new model or evaluate a saved one')
+    parser.add_argument('model_path', type=str, help='Path to the model file')
+    parser.add_argument('csv_files', type=str, nargs='+', help='Labeled csv files (text and the 9 label columns)')
+    args = parser.parse_args()
+    texts, labels = read_labeled_csv(args.csv_files)
+
+    if args.command == 'train':
+        classifier = LocalClassifier().train(texts, labels)
+        classifier.save(args.model_path)
+        print("trained on " + str(len(texts)) + " texts, saved to " + args.model_path)
+    else:
+        evaluate(load_classifier(args.model_path), texts, labels)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,13 @@
 import argparse
-import classification, full_examples, ceiling
-import json
-import csv
-
-
-def open_csv(input_path):
-    text_list = []
-    pred_list = []
-    with open(input_path, 'r') as csvfile:
-        csvreader = csv.reader(csvfile)
-        next(csvreader, None)
-        for row in csvreader:
-            text_list.append(row[0])
-            preds = [eval(i) for i in row[1:]]
-            pred_list.append(preds)
-    return text_list, pred_list
-
-
-def export_to_json(extracted_info, output_path, output_file_name):
-    n = 0
-    for response in extracted_info:
-        try:
-            extracted_json = json.loads(response)
-            with open(output_path + "/" + output_file_name + "_" + str(n)+'.json', 'w') as f:
-                json.dump(extracted_json, f, indent=4)
-            n += 1
-        except:
-            print("data number " + str(n) + " was not saved as json")
-            n += 1
+import os
+import sys
+import classification
+import batch_classification
+import metrics
+import pipeline
+import shards
+import streaming
+from result_writer import ResultWriter
 
 
 def main():
@@ -37,28 +17,72 @@ def main():
     parser.add_argument('output_path', type=str, help='Path to the output files')
     parser.add_argument('output_file_name', type=str, help='Output file name')
     parser.add_argument('te_model', type=str, help='Select text extraction model: classification, full_examples, ceiling', default='classification')
+    parser.add_argument('--config', type=str, default=None, help='JSON file with the settings below (named as in pipeline.OPTIONS); the flags given here take precedence')
+    parser.add_argument('--model', dest='model_name', type=str, default=None, help='Extraction model (gpt-4-1106-preview or gpt-4o-mini-2024-07-18)')
+    parser.add_argument('--examples', dest='directory', type=str, default=None, help='Path to the prompt examples (the example pool directory)')
+    parser.add_argument('--num-examples', dest='num_of_examples', type=int, default=None, help='Number of examples for each event type')
+    parser.add_argument('--api-key', type=str, default=None, help='OpenAI API key (read from the OPENAI_API_KEY environment variable if not given)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of requests in flight at once (1 sends them one at a time)')
+    parser.add_argument('--rpm', type=int, default=None, help='Requests per minute limit for the concurrent mode')
+    parser.add_argument('--tpm', type=int, default=None, help='Tokens per minute limit for the concurrent mode')
+    parser.add_argument('--base-url', type=str, default=None, help='Base url of an OpenAI-compatible server (e.g. the local mock_server.py)')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory of the on-disk response cache (no caching if not given)')
+    parser.add_argument('--classify-batch-size', type=int, default=1, help='Number of texts packed into one classification request')
+    parser.add_argument('--classify-batch-file', type=str, default=None, help='Write the classification requests to this Batch API JSONL file and exit')
+    parser.add_argument('--classify-results-file', type=str, default=None, help='Read the classification from this Batch API results file')
+    parser.add_argument('--resume', action='store_true', help='Skip the texts already saved in the output path by a previous run')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of rows classified at a time before their extraction starts (classification model)')
+    parser.add_argument('--max-prompt-tokens', type=int, default=None, help='Token budget of the extraction prompt (compact examples, as many as fit)')
+    parser.add_argument('--retrieve-examples', action='store_true', help='Use the examples most similar to each text (see example_index.py) instead of random ones')
+    parser.add_argument('--example-index', dest='example_index_path', type=str, default=None, help='Path of the saved example index (default: <example pool directory>_index.npz)')
+    parser.add_argument('--prompt-layout', type=str, default='random', choices=['random', 'prefix'], help='prefix: the same examples for the same classification vector, so requests share a cacheable prompt prefix')
+    parser.add_argument('--dedup', dest='deduplicate', action='store_true', help='Send each distinct clause once (placeholders and whitespace normalized) and save its result for all its duplicates')
+    parser.add_argument('--shard', type=str, default=None, help='i/N: process only the rows n with n %% N == i, saved under output_path/shard_<i>_of_<N> (see shards.py to merge them)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the random example selection, for reproducible runs')
+    parser.add_argument('--max-attempts', type=int, default=6, help='Attempts of a request before its row is saved to the dead-letter file (see scheduler.py)')
+    parser.add_argument('--metrics', action='store_true', help='Write the latency, retries and tokens of every LLM call to output_path/<output_file_name>_metrics.jsonl (see metrics.py)')
+    parser.add_argument('--classifier-model', type=str, default=None, help='Classify with this local model (see local_classifier.py) instead of the LLM')
     args = parser.parse_args()
+    if args.config is not None:
+        # the config file replaces the defaults, so the flags given on the command line still take precedence
+        parser.set_defaults(**pipeline.read_config(args.config))
+        args = parser.parse_args()
     file_path = args.input_file
     te_model = args.te_model
     output_path = args.output_path
     output_file_name = args.output_file_name
-    texts, preds = open_csv(file_path)
+    # the input file is read row by row while the texts are processed
+    texts = (record.text for record in streaming.iter_csv(file_path))
+    preds = (record.labels for record in streaming.iter_csv(file_path))
+
+    if args.classify_batch_file is not None:
+        num_texts = batch_classification.write_batch_file(texts, classification.read_classification_prompt(), args.classify_batch_file, args.classify_batch_size)
+        print("wrote the classification requests for " + str(num_texts) + " texts to " + args.classify_batch_file)
+        return
 
-    if te_model == "classification":
-        extracted_info = classification.main(texts)
-        export_to_json(extracted_info, output_path, output_file_name)
+    if te_model not in pipeline.TE_MODELS:
+        # a non-zero exit status, so that a failed shard is reported by shards.py
+        sys.exit("please choose text extraction model between 'classification', 'full_examples', and 'ceiling'!")
 
-    elif te_model == "full_examples":
-        extracted_info = full_examples.main(texts)
-        export_to_json(extracted_info, output_path, output_file_name)
-    
-    elif te_model == "ceiling":
-        extracted_info = ceiling.main(texts, preds)
-        export_to_json(extracted_info, output_path, output_file_name)
+    try:
+        extraction_pipeline = pipeline.Pipeline(**{name: getattr(args, name) for name in pipeline.OPTIONS})
+    except ValueError as e:
+        sys.exit(str(e))
 
-    else:
-        print("please choose text extraction model between 'classification', 'full_examples', and 'ceiling'!")
+    if extraction_pipeline.shard is not None:
+        # the results keep their index in the whole input file, each shard has its own directory (manifest and jsonl file)
+        output_path = shards.shard_directory(output_path, extraction_pipeline.shard)
 
+    # every result is saved as soon as it is received
+    with ResultWriter(output_path, output_file_name, resume=args.resume) as writer:
+        if args.resume:
+            print("resuming: " + str(len(writer.completed)) + " texts were already processed")
+        if args.metrics:
+            metrics.recorder.open(os.path.join(output_path, output_file_name + "_metrics.jsonl"), resume=args.resume)
+        try:
+            extraction_pipeline.run(te_model, texts, preds, writer)
+        finally:
+            metrics.recorder.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+import json
+import math
+import time
+import scheduler
+
+"""
+This program records one line of metrics per LLM call: its stage (classify, classify_batch or extract), the time it waited for a slot and for the rate limits (queue wait), its latency (retries included), its number of attempts and the time spent backing off between them, its prompt and completion tokens (from `response.usage`), and whether it was answered from the response cache. The lines are written to a JSONL file when one is opened (`main.py --metrics`), and a summary with the p50/p95/p99 latencies and the estimated cost per model is printed at the end of the run.
+"""
+
+# USD per million prompt / completion tokens, for the cost estimate
+PRICES = {
+    "gpt-4-1106-preview": (10.0, 30.0),
+    "gpt-4o-mini-2024-07-18": (0.15, 0.6),
+    "gpt-3.5-turbo-0125": (0.5, 1.5),
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class MetricsRecorder:
+    def __init__(self):
+        self.file = None
+        # stage -> lists of latencies and queue waits, and the sums of the other metrics
+        self.stages = {}
+        # model -> [calls, prompt tokens, completion tokens] of the calls not answered from the cache
+        self.models = {}
+
+    # Writes every call to metrics_file from now on (appended to the file when a run is resumed)
+    def open(self, metrics_file, resume=False):
+        self.close()
+        self.file = open(metrics_file, 'a' if resume else 'w', encoding='utf-8')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def record(self, stage, model, latency, attempts, backoff, queue_wait=0.0, usage=None, cached=False, error=None, index=None):
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        if self.file is not None:
+            line = {"time": time.time(), "stage": stage, "index": index, "model": model, "queue_wait": round(queue_wait, 6), "latency": round(latency, 6),
+                    "attempts": attempts, "backoff": round(backoff, 6), "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                    "cached": cached, "error": error}
+            self.file.write(json.dumps(line) + "\n")
+            self.file.flush()
+        stats = self.stages.setdefault(stage, {"latencies": [], "queue_waits": [], "errors": 0, "retries": 0, "backoff": 0.0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        stats["latencies"].append(latency)
+        stats["queue_waits"].append(queue_wait)
+        stats["errors"] += error is not None
+        stats["retries"] += max(0, attempts - 1)
+        stats["backoff"] += backoff
+        stats["cached"] += cached
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        if not cached and usage is not None:
+            totals = self.models.setdefault(model, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+
+    def summary(self):
+        stages = {}
+        for stage, stats in self.stages.items():
+            stages[stage] = {
+                "calls": len(stats["latencies"]),
+                "errors": stats["errors"],
+                "cached": stats["cached"],
+                "retries": stats["retries"],
+                "backoff": stats["backoff"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "latency": {name: percentile(stats["latencies"], q) for name, q in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]},
+                "queue_wait": {name: percentile(stats["queue_waits"], q) for name, q in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]},
+            }
+        costs = {}
+        for model, (calls, prompt_tokens, completion_tokens) in self.models.items():
+            prompt_price, completion_price = PRICES.get(model, (None, None))
+            cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6 if prompt_price is not None else None
+            costs[model] = {"calls": calls, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cost": cost}
+        return {"stages": stages, "models": costs}
+
+    def report(self):
+        summary = self.summary()
+        for stage, stats in summary["stages"].items():
+            latency = stats["latency"]
+            queue_wait = stats["queue_wait"]
+            print(f"{stage}: {stats['calls']} calls ({stats['cached']} cached, {stats['errors']} failed, {stats['retries']} retries, {stats['backoff']:.1f}s backoff), "
+                  f"latency p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s p99 {latency['p99']:.2f}s, "
+                  f"queue wait p50 {queue_wait['p50']:.2f}s p95 {queue_wait['p95']:.2f}s p99 {queue_wait['p99']:.2f}s, "
+                  f"{stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens")
+        for model, totals in summary["models"].items():
+            cost = f"${totals['cost']:.4f}" if totals["cost"] is not None else "unknown price"
+            print(f"{model}: {totals['calls']} calls, {totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens, estimated cost {cost}")
+        return summary
+
+
+# the recorder of the run (the calls are always summarized, and written to a file once one is opened)
+recorder = MetricsRecorder()
+
+
+def is_cached(client, request):
+    cache = getattr(client, "cache", None)
+    return cache is not None and cache.contains(request)
+
+
+# Sends the request with client, retried by the shared scheduler (see scheduler.py), and records its metrics
+def call(stage, client, request, index=None):
+    stats = {}
+    cached = is_cached(client, request)
+    start = time.perf_counter()
+    try:
+        response = scheduler.shared.send(client.chat.completions.create, request, stats)
+    except Exception as e:
+        record_call(stage, request, stats, time.perf_counter() - start, cached=cached, error=type(e).__name__, index=index)
+        raise
+    record_call(stage, request, stats, time.perf_counter() - start, usage=response.usage, cached=cached, index=index)
+    return response
+
+
+# stats holds the attempts, backoff and queue wait of the call (filled by the scheduler); elapsed is the wall time of
+# the call, the latency being the time not spent waiting for a slot
+def record_call(stage, request, stats, elapsed, usage=None, cached=False, error=None, index=None):
+    queue_wait = stats.get("queue_wait", 0.0)
+    recorder.record(stage, request.get("model"), elapsed - queue_wait, stats.get("attempts", 1), stats.get("backoff", 0.0),
+                    queue_wait, usage, cached, error, index)
@@ -0,0 +1,131 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+This program is a local stand-in for the OpenAI chat completions endpoint, used for testing the extraction drivers and measuring throughput without an API key. Every request is answered after a fixed latency. Classification requests (no response_format) get a label list, batched classification requests get one label list per numbered text, and extraction requests get an empty extraction that echoes the input text. To test the retries, the server can also answer with 429 errors, either at random (`--error-rate`) or when the requests go over a requests-per-minute limit (`--rpm`), with the `retry-after` and `x-ratelimit-*` headers of the real API, and vary its latency (`--latency-jitter`). To run the server, run the following code:
+```
+python mock_server.py --port 8000 --latency 0.5
+```
+and point the client to `http://127.0.0.1:8000/v1`.
+"""
+
+
+# Requests-per-minute limit shared by the handler threads, refilled continuously like the real API
+class RequestBudget:
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self.budget = float(rpm)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Returns (allowed, remaining requests, seconds until one more request is allowed)
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.budget = min(float(self.rpm), self.budget + (now - self.last_refill) * self.rpm / 60)
+            self.last_refill = now
+            if self.budget < 1:
+                return False, 0, (1 - self.budget) * 60 / self.rpm
+            self.budget -= 1
+            return True, int(self.budget), (self.rpm - self.budget) * 60 / self.rpm
+
+
+def make_handler(latency, latency_jitter=0.0, error_rate=0.0, rpm=None):
+    budget = RequestBudget(rpm) if rpm else None
+
+    class MockHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body, headers):
+            body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def rate_limited(self, wait, remaining=0):
+            error = {"error": {"message": "Rate limit reached (mock server)", "type": "requests", "code": "rate_limit_exceeded"}}
+            self.send_json(429, error, {"retry-after-ms": str(int(wait * 1000)), "x-ratelimit-remaining-requests": str(remaining),
+                                        "x-ratelimit-reset-requests": str(int(wait * 1000)) + "ms"})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            rate_limit_headers = {}
+            if budget is not None:
+                allowed, remaining, reset = budget.take()
+                if not allowed:
+                    self.rate_limited(reset)
+                    return
+                rate_limit_headers = {"x-ratelimit-limit-requests": str(rpm), "x-ratelimit-remaining-requests": str(remaining),
+                                      "x-ratelimit-reset-requests": str(int(reset * 1000)) + "ms"}
+            if error_rate and random.random() < error_rate:
+                self.rate_limited(random.uniform(0.1, 1.0))
+                return
+            time.sleep(latency + random.uniform(0, latency_jitter))
+            target_text = request["messages"][-1]["content"]
+            if '{"results"' in request["messages"][0]["content"]:
+                # batched classification: one label list per numbered text
+                num_texts = len(re.findall(r'^\[\d+\] ', target_text, flags=re.MULTILINE))
+                content = json.dumps({"results": [[1, 0, 0, 0, 0, 0, 0, 0, 0]] * num_texts})
+            elif request.get("response_format", {}).get("type") == "json_object":
+                content = json.dumps({"text": target_text, "entities": [], "events": []})
+            else:
+                content = "[1, 0, 0, 0, 0, 0, 0, 0, 0]"
+            prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+            completion_tokens = len(content) // 4
+            self.send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            }, rate_limit_headers)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+
+# the default listen backlog (5) drops connections as soon as many clients connect at once
+class MockServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def make_server(host='127.0.0.1', port=8000, latency=0.5, latency_jitter=0.0, error_rate=0.0, rpm=None):
+    return MockServer((host, port), make_handler(latency, latency_jitter, error_rate, rpm))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the OpenAI chat completions endpoint')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds to wait before answering each request')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='Random extra latency, up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of the requests answered with a 429 error at random')
+    parser.add_argument('--rpm', type=int, default=None, help='Requests per minute accepted before answering 429')
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency, args.latency_jitter, args.error_rate, args.rpm)
+    print(f"serving on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import json
+import os
+import time
+import async_engine
+import ceiling
+import classification
+import create_full_prompt
+import dedup
+import example_index
+import full_examples
+import metrics
+import response_cache
+import scheduler
+import shards
+from openai import OpenAI
+
+"""
+This program runs the information extraction system without any interactive question, so that it can run in batch jobs, in parallel shards or from Python. Every setting is an argument of `Pipeline` (or a key of a JSON config file), and the API key is read from the `OPENAI_API_KEY` environment variable. The settings that are not given are still asked with `input()`. For example:
+```
+from pipeline import Pipeline
+pipeline = Pipeline(model_name="gpt-4o-mini-2024-07-18", directory="../data/example_pool", num_of_examples=1, concurrency=8)
+extracted_info = pipeline.run("classification", ["I give my house to my son."])
+```
+The pipeline keeps one OpenAI client (with the response cache) for all its requests, and the three text extraction models (classification, full_examples, ceiling) send their extraction requests through the same stage (`Pipeline.extract`).
+"""
+
+MODELS = ['gpt-4-1106-preview', 'gpt-4o-mini-2024-07-18']
+TE_MODELS = ['classification', 'full_examples', 'ceiling']
+
+# the settings of a pipeline (the arguments of Pipeline and the keys of a config file) and their defaults
+OPTIONS = {
+    "model_name": None,
+    "directory": None,
+    "num_of_examples": None,
+    "api_key": None,
+    "concurrency": 1,
+    "rpm": None,
+    "tpm": None,
+    "base_url": None,
+    "cache_dir": None,
+    "classify_batch_size": 1,
+    "classify_results_file": None,
+    "classifier_model": None,
+    "chunk_size": 1000,
+    "max_prompt_tokens": None,
+    "retrieve_examples": False,
+    "example_index_path": None,
+    "prompt_layout": "random",
+    "deduplicate": False,
+    "seed": None,
+    "shard": None,
+    "max_attempts": 6,
+}
+
+
+# Retried with exponential backoff, with the latency, retries and tokens of the request recorded (see metrics.py)
+def extract_information(prompt, target_text, model_name, client, index=None):
+    return metrics.call("extract", client, async_engine.extraction_request(prompt, target_text, model_name), index)
+
+
+# Returns the value, or asks for it if it wasn't given (an error when there is nobody to answer)
+def ask(value, question):
+    if value is not None:
+        return value
+    try:
+        return input(question)
+    except EOFError:
+        raise ValueError("no answer to \"" + question.strip() + "\", give it as an argument or in the config file")
+
+
+def read_config(config_file):
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    unknown = sorted(set(config) - set(OPTIONS))
+    if unknown:
+        raise ValueError("unknown settings in " + config_file + ": " + ", ".join(unknown))
+    return config
+
+
+class Pipeline:
+    def __init__(self, **settings):
+        unknown = sorted(set(settings) - set(OPTIONS))
+        if unknown:
+            raise TypeError("unknown settings: " + ", ".join(unknown))
+        for name, default in OPTIONS.items():
+            setattr(self, name, settings[name] if settings.get(name) is not None else default)
+        # "i/N": only the rows n with n % N == i are processed (see shards.py)
+        if isinstance(self.shard, str):
+            self.shard = shards.parse_shard(self.shard)
+
+        # the same questions as the interactive scripts, only for the settings that weren't given
+        self.model_name = ask(self.model_name, "Please choose the model (gpt-4-1106-preview or gpt-4o-mini-2024-07-18): ")
+        self.directory = ask(self.directory, "Please provide the path to the prompt examples: ")
+        self.num_of_examples = int(ask(self.num_of_examples, "How many examples do you want to use for each event type? "))
+        if self.model_name not in MODELS:
+            raise ValueError("Please choose between gpt-4-1106-preview and gpt-4o-mini-2024-07-18!")
+        if self.prompt_layout == "prefix" and self.retrieve_examples:
+            raise ValueError("the prefix prompt layout uses the same examples for every text of a classification vector, it can't be combined with example retrieval!")
+        self.api_key = ask(self.api_key or os.environ.get("OPENAI_API_KEY"), "Please enter your openai api key: ")
+
+        if self.seed is not None:
+            create_full_prompt.set_seed(self.seed)
+        # one scheduler for all the requests of the run: the retries wait for the server's rate limits (see scheduler.py)
+        scheduler.shared = scheduler.Scheduler(self.max_attempts)
+        self.cache = response_cache.open_cache(self.cache_dir)
+        self.client = response_cache.wrap_client(OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0), self.cache)
+        # the examples most similar to each text are retrieved instead of random ones (see example_index.py)
+        self.index = example_index.get_example_index(self.directory, self.example_index_path) if self.retrieve_examples else None
+        self.deduplicator = None
+
+    # Each distinct clause is sent once, its result is saved for the other texts of the clause (see dedup.py)
+    def wrap_writer(self, writer):
+        if not self.deduplicate or writer is None:
+            return writer
+        self.deduplicator = dedup.Deduplicator()
+        return dedup.DedupWriter(writer, self.deduplicator)
+
+    # Yields (n, row) for the rows of the pipeline's shard, n being the index of the row in the whole input
+    def rows(self, items):
+        for n, item in enumerate(items):
+            if shards.in_shard(n, self.shard):
+                yield n, item
+
+    # Yields the (n, text, ...) items that still have to be processed: not saved by an earlier run, and not a duplicate
+    def pending(self, items, writer):
+        if writer is not None:
+            items = (item for item in items if not writer.is_completed(item[0]))
+        if self.deduplicator is not None:
+            items = self.deduplicator.filter(items, writer)
+        return items
+
+    def prompt(self, classification_vector, example_list=None):
+        return create_full_prompt.main(self.directory, classification_vector, self.num_of_examples, self.max_prompt_tokens, example_list, self.prompt_layout)
+
+    # Turns (n, text, pred) items into (n, text, prompt) items, in the order they should be sent
+    def with_prompts(self, items, writer):
+        if self.prompt_layout == "prefix" and writer is not None:
+            # the texts with the same classification vector are sent one after another
+            items = create_full_prompt.group_by_classification(items, self.chunk_size)
+        for n, text, pred, example_list in example_index.attach_examples(items, self.directory, self.num_of_examples, self.index):
+            yield n, text, self.prompt(pred, example_list)
+
+    # The extraction stage: sends one request per (n, text, prompt) item, concurrently or one at a time. With a writer,
+    # each result is saved as soon as it is received, failed texts are saved to the dead-letter file and the number of saved results is
+    # returned; without a writer, the results are returned in order, up to the first failed text.
+    def extract(self, items, writer=None):
+        if self.concurrency > 1:
+            requests = ((n, async_engine.extraction_request(prompt, text, self.model_name)) for n, text, prompt in items)
+            return async_engine.extract_text_list(requests, self.api_key, self.concurrency, self.rpm, self.tpm, self.base_url, self.cache, writer)
+        extracted_info = []
+        for n, text, prompt in items:
+            print("processing " + str(n+1) + "th sentence!")
+            try:
+                response = extract_information(prompt, text, self.model_name, self.client, n)
+            except Exception as e:
+                print("something went wrong while processing " + str(n) + "th text!")
+                if writer is None:
+                    return extracted_info
+                writer.fail(n, "extract", e)
+                continue
+            if writer is None:
+                extracted_info.append(response.choices[0].message.content)
+            else:
+                writer.write(n, response.choices[0].message.content)
+        return writer.written if writer is not None else extracted_info
+
+    # prefix_sharing is False when all the texts are sent with the same prompt
+    def report(self, num_texts, start, prefix_sharing=True):
+        async_engine.report_throughput(num_texts, time.perf_counter() - start)
+        scheduler.shared.report()
+        if self.cache is not None:
+            self.cache.report()
+        create_full_prompt.report_token_savings()
+        if self.deduplicator is not None:
+            self.deduplicator.report()
+        if prefix_sharing:
+            create_full_prompt.report_prefix_sharing()
+        metrics.recorder.report()
+
+    # texts (and preds, the classification vectors used by ceiling) can be any iterables, e.g. a csv file read row by row
+    def run(self, te_model, texts, preds=None, writer=None):
+        if te_model == "classification":
+            return classification.run(self, texts, writer)
+        if te_model == "full_examples":
+            return full_examples.run(self, texts, writer)
+        if te_model == "ceiling":
+            return ceiling.run(self, texts, preds, writer)
+        raise ValueError("please choose text extraction model between 'classification', 'full_examples', and 'ceiling'!")
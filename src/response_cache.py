@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from openai.types.chat import ChatCompletion
+
+"""
+This program keeps a persistent on-disk cache of the LLM responses. All requests use temperature=0, so a request with the same model, messages and parameters is answered from the cache instead of calling the API again. The responses are stored in a SQLite file in the cache directory, keyed by a hash of the whole request, and the least recently used responses are evicted once the cache grows beyond `max_bytes`.
+"""
+
+
+class ResponseCache:
+    def __init__(self, cache_dir, max_bytes=1024 ** 3):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # the async engine and thread pools may use the cache from several threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, size INTEGER, last_access REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    # The key covers everything sent to the API: model, system prompt, user text and parameters
+    @staticmethod
+    def make_key(request):
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def contains(self, request):
+        key = self.make_key(request)
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, request):
+        key = self.make_key(request)
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            return row[0]
+
+    def put(self, request, response):
+        key = self.make_key(request)
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                                    (key, response, size, time.time()))
+            self.total_bytes += size
+            self.evict()
+            self.connection.commit()
+
+    # Removes the least recently used responses until the cache fits in max_bytes
+    def evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.connection.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total > 0 else 0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate, "bytes": self.total_bytes}
+
+    def report(self):
+        stats = self.stats()
+        print(f"response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), {stats['bytes']} bytes on disk")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_cache(cache_dir, max_bytes=1024 ** 3):
+    if cache_dir is None:
+        return None
+    return ResponseCache(cache_dir, max_bytes)
+
+
+# Wraps an OpenAI client so that client.chat.completions.create is answered from the cache when possible
+class CachedClient:
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        cached = self.cache.get(request)
+        if cached is not None:
+            return ChatCompletion.model_validate_json(cached)
+        response = self.client.chat.completions.create(**request)
+        self.cache.put(request, response.model_dump_json())
+        return response
+
+    def close(self):
+        self.client.close()
+
+
+# Same as CachedClient, for AsyncOpenAI clients
+class AsyncCachedClient:
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **request):
+        cached = self.cache.get(request)
+        if cached is not None:
+            return ChatCompletion.model_validate_json(cached)
+        response = await self.client.chat.completions.create(**request)
+        self.cache.put(request, response.model_dump_json())
+        return response
+
+    async def close(self):
+        await self.client.close()
+
+
+def wrap_client(client, cache):
+    if cache is None:
+        return client
+    return CachedClient(client, cache)
+
+
+def wrap_async_client(client, cache):
+    if cache is None:
+        return client
+    return AsyncCachedClient(client, cache)
@@ -0,0 +1,123 @@
+import json
+import os
+
+"""
+This program saves the extraction results as soon as each of them is received, instead of keeping all of them in memory until the end of the run. Every result is appended to `<output_file_name>.jsonl` (the raw LLM output with its index), saved as `<output_file_name>_<index>.json` (see `ResultWriter.write`), and its index is appended to `<output_file_name>_manifest.txt`. When a run is resumed, the indices in the manifest are skipped. The rows whose requests were given up (see scheduler.py) are appended to the dead-letter file `<output_file_name>_dead_letters.jsonl` with their stage and error; they are not in the manifest, so a resumed run tries them again, and the file then only lists the rows that are still failing.
+"""
+
+
+class ResultWriter:
+    def __init__(self, output_path, output_file_name, resume=False):
+        os.makedirs(output_path, exist_ok=True)
+        self.output_path = output_path
+        self.output_file_name = output_file_name
+        self.jsonl_file = os.path.join(output_path, output_file_name + ".jsonl")
+        self.manifest_file = os.path.join(output_path, output_file_name + "_manifest.txt")
+        self.dead_letter_file = os.path.join(output_path, output_file_name + "_dead_letters.jsonl")
+        self.completed = read_manifest(self.manifest_file) if resume else set()
+        self.jsonl = open_output(self.jsonl_file, resume)
+        self.manifest = open_output(self.manifest_file, resume)
+        # opened with the first failed row (the rows of an earlier run are tried again, so their dead letters go)
+        self.dead_letters = None
+        if not resume and os.path.exists(self.dead_letter_file):
+            os.remove(self.dead_letter_file)
+        self.resume = resume
+        if resume:
+            self.clean_dead_letters()
+        self.written = 0
+        self.failed = 0
+
+    def is_completed(self, index):
+        return index in self.completed
+
+    # Returns the indices (out of num_texts) that still have to be processed
+    def pending_indices(self, num_texts):
+        return [n for n in range(num_texts) if n not in self.completed]
+
+    def write(self, index, response):
+        self.jsonl.write(json.dumps({"index": index, "response": response}, ensure_ascii=False) + "\n")
+        self.jsonl.flush()
+        try:
+            extracted_json = json.loads(response)
+            with open(self.output_path + "/" + self.output_file_name + "_" + str(index) + '.json', 'w') as f:
+                json.dump(extracted_json, f, indent=4)
+        except:
+            print("data number " + str(index) + " was not saved as json")
+        # the index goes to the manifest last, so an interrupted write is redone on resume
+        self.manifest.write(str(index) + "\n")
+        self.manifest.flush()
+        self.completed.add(index)
+        self.written += 1
+
+    def fail(self, index, stage, error):
+        if self.dead_letters is None:
+            self.dead_letters = open_output(self.dead_letter_file, self.resume)
+        self.dead_letters.write(json.dumps({"index": index, "stage": stage, "error": type(error).__name__, "message": str(error)}, ensure_ascii=False) + "\n")
+        self.dead_letters.flush()
+        self.failed += 1
+
+    # Keeps, in the dead-letter file, the last failure of each row that is still not completed (a resumed run drops
+    # the rows it processed, and a row that failed again is listed once)
+    def clean_dead_letters(self):
+        if not os.path.exists(self.dead_letter_file):
+            return
+        lines = {}
+        with open(self.dead_letter_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                # a line cut by a crash is not a dead letter
+                if not line.endswith("\n") or not line.strip():
+                    continue
+                try:
+                    index = json.loads(line)["index"]
+                except (json.JSONDecodeError, KeyError):
+                    continue
+                if index not in self.completed:
+                    lines.pop(index, None)
+                    lines[index] = line
+        with open(self.dead_letter_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines.values())
+
+    def close(self):
+        self.jsonl.close()
+        self.manifest.close()
+        if self.dead_letters is not None:
+            self.dead_letters.close()
+        if self.resume:
+            self.clean_dead_letters()
+        if self.failed:
+            print(str(self.failed) + " rows failed and were saved to " + self.dead_letter_file + ", run again with --resume to retry them")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def ends_with_newline(file_path):
+    with open(file_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+# Opens an output file for appending (resume) or from scratch
+def open_output(file_path, resume):
+    if not resume:
+        return open(file_path, 'w', encoding='utf-8')
+    f = open(file_path, 'a', encoding='utf-8')
+    if f.tell() > 0 and not ends_with_newline(file_path):
+        # finish a line cut by a crash so the next line doesn't get appended to it
+        f.write("\n")
+    return f
+
+
+def read_manifest(manifest_file):
+    completed = set()
+    if not os.path.exists(manifest_file):
+        return completed
+    with open(manifest_file, 'r') as f:
+        for line in f:
+            # a line cut by a crash has no newline and is ignored
+            if line.endswith("\n") and line.strip():
+                completed.add(int(line))
+    return completed
@@ -0,0 +1,218 @@
+import asyncio
+import email.utils
+import random
+import re
+import time
+import openai
+
+"""
+This program schedules the retries of the LLM calls for the whole run, instead of letting every call back off on its own. When a request is rate limited (429), the scheduler waits for the time given by the server (`retry-after`, `retry-after-ms`, or the `x-ratelimit-reset-*` headers) before letting any request through, so the waiting requests don't all retry at the same moment. The number of requests in flight adapts with AIMD: it grows by one for every window of successful requests (up to `--concurrency`), and is halved when the server answers 429 or 503. Other errors (server errors, timeouts, lost connections) are retried with a jittered exponential backoff, and a request that still fails after `max_attempts` attempts (or with an error that can't be fixed by retrying, e.g. 400) is given up: its row is saved to the dead-letter file (see result_writer.py) and the run goes on. To watch the scheduler against rate limits, start the local stand-in server with `python mock_server.py --port 8000 --rpm 120 --error-rate 0.1` and run `main.py` with `--base-url http://127.0.0.1:8000/v1 --concurrency 16`.
+"""
+
+# statuses worth retrying; 429 and 503 also mean that too many requests are sent at once
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+OVERLOADED_STATUSES = {429, 503}
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+# Parses the durations of the x-ratelimit-reset-* headers ("20ms", "1s", "6m0s")
+def parse_duration(value):
+    parts = DURATION_PATTERN.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+# The number of seconds the server asks to wait before the next request, None if it doesn't say
+def retry_after(headers):
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    resets = [parse_duration(headers[name]) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens") if headers.get(name)]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def error_status(exception):
+    return getattr(exception, "status_code", None)
+
+
+def error_headers(exception):
+    response = getattr(exception, "response", None)
+    return getattr(response, "headers", None)
+
+
+def is_retryable(exception):
+    if isinstance(exception, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return error_status(exception) in RETRYABLE_STATUSES
+
+
+class Scheduler:
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # the AIMD window: the number of requests allowed in flight, between 1 and max_concurrency
+        self.max_concurrency = 1
+        self.limit = 1.0
+        # no request is sent before paused_until (time.monotonic()), set when the server asks to wait
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.num_overloaded = 0
+        self.num_decreases = 0
+        self.num_given_up = 0
+
+    # Called by each concurrent engine; the window starts at the full concurrency and only shrinks when the server pushes back
+    def set_concurrency(self, concurrency):
+        if concurrency != self.max_concurrency:
+            self.max_concurrency = max(1, concurrency)
+            self.limit = float(self.max_concurrency)
+
+    def window(self):
+        return max(1, int(self.limit))
+
+    def pause_time(self):
+        return max(0.0, self.paused_until - time.monotonic())
+
+    # Full jitter: a random delay up to base_delay * 2^(attempt - 1), so the retries of concurrent requests spread out
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    # Additive increase: about one more request in flight per window of successful requests
+    def on_success(self):
+        self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+    # Returns the seconds to wait before the next attempt, or None when the request should be given up. started is
+    # the time.monotonic() at which the failed attempt was sent.
+    def on_error(self, exception, attempt, started):
+        if attempt >= self.max_attempts or not is_retryable(exception):
+            self.num_given_up += 1
+            return None
+        delay = retry_after(error_headers(exception))
+        if delay is None:
+            delay = self.backoff(attempt)
+        delay = min(delay, self.max_delay)
+        if error_status(exception) in OVERLOADED_STATUSES:
+            self.num_overloaded += 1
+            # multiplicative decrease, once for all the requests that were already in flight when the window shrank
+            if started >= self.last_decrease:
+                limit = max(1.0, self.limit / 2)
+                # at a window of 1 nothing shrinks, so it isn't counted as a decrease
+                if limit != self.limit:
+                    self.num_decreases += 1
+                self.limit = limit
+                self.last_decrease = time.monotonic()
+            # every request waits, not only the one that was rate limited
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    # Sends the request with create, retrying it as long as the scheduler allows. stats gets the number of attempts
+    # and the seconds spent waiting between them.
+    def send(self, create, request, stats):
+        stats.update(attempts=0, backoff=0.0)
+        while True:
+            pause = self.pause_time()
+            if pause > 0:
+                time.sleep(pause)
+                stats["backoff"] += pause
+            stats["attempts"] += 1
+            started = time.monotonic()
+            try:
+                response = create(**request)
+            except Exception as e:
+                delay = self.on_error(e, stats["attempts"], started)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                stats["backoff"] += delay
+                continue
+            self.on_success()
+            return response
+
+    # Same as send, for a coroutine function create. The gate holds a slot of the window while a request is in flight;
+    # the waits for a slot are added to stats["queue_wait"].
+    async def send_async(self, create, request, gate, stats, before_attempt=None):
+        stats.update(attempts=0, backoff=0.0, queue_wait=0.0)
+        while True:
+            start = time.perf_counter()
+            await gate.acquire()
+            stats["queue_wait"] += time.perf_counter() - start
+            stats["attempts"] += 1
+            started = time.monotonic()
+            try:
+                if before_attempt is not None:
+                    await before_attempt()
+                response = await create(**request)
+            except Exception as e:
+                delay = self.on_error(e, stats["attempts"], started)
+                if delay is None:
+                    raise
+                await gate.release()
+                await asyncio.sleep(delay)
+                stats["backoff"] += delay
+                continue
+            else:
+                self.on_success()
+                return response
+            finally:
+                if gate.holds_slot():
+                    await gate.release()
+
+    def report(self):
+        if self.num_overloaded or self.num_given_up:
+            print(f"scheduler: {self.num_overloaded} rate-limited or overloaded responses, window halved {self.num_decreases} times "
+                  f"(now {self.window()} of {self.max_concurrency}), {self.num_given_up} requests given up")
+
+
+# Lets at most scheduler.window() requests of an event loop be in flight, and none while the scheduler is paused
+class AsyncGate:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        # the slots taken by the current task, so a slot released before a backoff isn't released twice
+        self.holders = set()
+
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                pause = self.scheduler.pause_time()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < self.scheduler.window():
+                    break
+                await self.condition.wait()
+            self.in_flight += 1
+            self.holders.add(asyncio.current_task())
+
+    def holds_slot(self):
+        return asyncio.current_task() in self.holders
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.holders.discard(asyncio.current_task())
+            self.condition.notify_all()
+
+
+# the scheduler of the run, shared by all the calls (replaced by the pipeline with its settings)
+shared = Scheduler()
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+from result_writer import read_manifest
+
+"""
+This program splits a run of `main.py` across several machines (or processes) and merges their outputs. With `--shard i/N`, `main.py` only processes the rows whose index n in the input file has n % N == i, and saves them under `<output_path>/shard_<i>_of_<N>/` with their index in the whole file, so the outputs of the shards never collide. To merge the outputs of the shards into `<output_path>` (the json files, the jsonl file and the manifest, as if the whole file had been processed by one run), run the following code:
+```
+python shards.py merge path/to/the/output/files output_file_name
+```
+The merged directory can be given to `auto_evaluator.py` as the prediction path (with `output_file_name_` as the prediction file name). To run the N shards as local processes and merge them, run the following code (the arguments after `--` are the ones of `main.py`, without `--shard`):
+```
+python shards.py run-local 4 -- path/to/the/input/file path/to/the/output/files output_file_name classification --model gpt-4o-mini-2024-07-18 --examples ../data/example_pool --num-examples 5
+```
+"""
+
+
+# Parses "i/N" into (i, N)
+def parse_shard(shard):
+    try:
+        index, num_shards = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError("the shard should be given as i/N (e.g. 0/4), not " + shard)
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError("the shard index should be between 0 and N-1, got " + shard)
+    return index, num_shards
+
+
+def in_shard(n, shard):
+    return shard is None or n % shard[1] == shard[0]
+
+
+def shard_directory(output_path, shard):
+    return os.path.join(output_path, "shard_" + str(shard[0]) + "_of_" + str(shard[1]))
+
+
+def find_shard_directories(output_path):
+    directories = []
+    for name in os.listdir(output_path):
+        parts = name.split("_")
+        if len(parts) == 4 and parts[0] == "shard" and parts[2] == "of" and parts[1].isdigit() and parts[3].isdigit():
+            directories.append(((int(parts[3]), int(parts[1])), os.path.join(output_path, name)))
+    return [directory for key, directory in sorted(directories)]
+
+
+# Merges the outputs of the shard directories into merged_path: the json files are copied, the jsonl lines are
+# written in index order (the last line of an index wins if it was processed twice) and the manifest lists every
+# index. Returns the merged indices.
+def merge_shards(output_path, output_file_name, merged_path=None):
+    merged_path = merged_path or output_path
+    os.makedirs(merged_path, exist_ok=True)
+    directories = find_shard_directories(output_path)
+    if not directories:
+        raise ValueError("no shard directories (shard_<i>_of_<N>) in " + output_path)
+    num_shards = set(int(os.path.basename(directory).split("_")[3]) for directory in directories)
+    if len(num_shards) > 1:
+        raise ValueError("the shard directories come from runs with different numbers of shards: " + ", ".join(str(n) for n in sorted(num_shards)))
+
+    lines = {}
+    completed = set()
+    for directory in directories:
+        completed |= read_manifest(os.path.join(directory, output_file_name + "_manifest.txt"))
+        jsonl_file = os.path.join(directory, output_file_name + ".jsonl")
+        if os.path.exists(jsonl_file):
+            with open(jsonl_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    # a line cut by a crash is not a result
+                    if not line.endswith("\n") or not line.strip():
+                        continue
+                    try:
+                        lines[json.loads(line)["index"]] = line
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+        prefix = output_file_name + "_"
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith(".json") and name[len(prefix):-len(".json")].isdigit():
+                shutil.copyfile(os.path.join(directory, name), os.path.join(merged_path, name))
+
+    with open(os.path.join(merged_path, output_file_name + ".jsonl"), 'w', encoding='utf-8') as f:
+        for index in sorted(lines):
+            f.write(lines[index])
+    with open(os.path.join(merged_path, output_file_name + "_manifest.txt"), 'w', encoding='utf-8') as f:
+        for index in sorted(completed):
+            f.write(str(index) + "\n")
+    return completed
+
+
+def report_merge(completed, num_shards, merged_path, output_file_name, num_rows=None):
+    print("merged " + str(len(completed)) + " results from " + str(num_shards) + " shards into " + merged_path)
+    expected = range(num_rows if num_rows is not None else (max(completed) + 1 if completed else 0))
+    missing = [n for n in expected if n not in completed]
+    if missing:
+        print(str(len(missing)) + " rows are missing (e.g. " + ", ".join(str(n) for n in missing[:10]) + "), run the shards again with --resume")
+    no_json = [n for n in sorted(completed) if not os.path.exists(os.path.join(merged_path, output_file_name + "_" + str(n) + ".json"))]
+    if no_json:
+        print(str(len(no_json)) + " results were not saved as json (e.g. " + ", ".join(str(n) for n in no_json[:10]) + ")")
+
+
+# Runs main.py once per shard as local processes, then merges their outputs. Returns None if no shard saved any output.
+def run_local(num_shards, main_args):
+    if len(main_args) < 3:
+        raise ValueError("the arguments of main.py are missing (input_file output_path output_file_name te_model ...)")
+    main_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    processes = [subprocess.Popen([sys.executable, main_file] + main_args + ["--shard", str(n) + "/" + str(num_shards)], stdin=subprocess.DEVNULL)
+                 for n in range(num_shards)]
+    failed = [n for n, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        print("shards " + ", ".join(str(n) for n in failed) + " failed")
+    output_path, output_file_name = main_args[1], main_args[2]
+    if len(failed) == num_shards or not os.path.isdir(output_path) or not find_shard_directories(output_path):
+        print("no shard saved any output in " + output_path + ", nothing to merge")
+        return None
+    completed = merge_shards(output_path, output_file_name)
+    report_merge(completed, num_shards, output_path, output_file_name)
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the outputs of a sharded run, or run the shards as local processes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='merge the shard directories of an output path')
+    merge_parser.add_argument('output_path', type=str, help='Output path given to main.py (with the shard_<i>_of_<N> directories)')
+    merge_parser.add_argument('output_file_name', type=str, help='Output file name given to main.py')
+    merge_parser.add_argument('--merged-path', type=str, default=None, help='Directory of the merged outputs (default: the output path)')
+    merge_parser.add_argument('--num-rows', type=int, default=None, help='Number of rows of the input file, to report the missing ones')
+    local_parser = subparsers.add_parser('run-local', help='run main.py once per shard as local processes and merge the outputs')
+    local_parser.add_argument('num_shards', type=int, help='Number of shards (processes)')
+    local_parser.add_argument('main_args', nargs=argparse.REMAINDER, help='Arguments of main.py, after --')
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        completed = merge_shards(args.output_path, args.output_file_name, args.merged_path)
+        report_merge(completed, len(find_shard_directories(args.output_path)), args.merged_path or args.output_path, args.output_file_name, args.num_rows)
+    else:
+        main_args = args.main_args[1:] if args.main_args[:1] == ["--"] else args.main_args
+        if run_local(args.num_shards, main_args) is None:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
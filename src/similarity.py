@@ -0,0 +1,82 @@
+import difflib
+from collections import Counter
+from functools import lru_cache
+
+"""
+This program is the string similarity kernel of the auto evaluator. `ratio` is `difflib.SequenceMatcher(None, text1, text2).ratio()` memoized per text pair. `upper_bound` is a cheap bound on the ratio (the same bounds as `real_quick_ratio` and `quick_ratio`), so that pairs which can't beat the current best similarity or a threshold are skipped without running SequenceMatcher. `batch_ratios` scores many texts against one text, reusing the matcher's index of that text.
+"""
+
+# (text1, text2) -> ratio. Cleared when it grows beyond MAX_CACHED_RATIOS.
+cached_ratios = {}
+MAX_CACHED_RATIOS = 1 << 20
+
+
+def store_ratio(key, value):
+    if len(cached_ratios) >= MAX_CACHED_RATIOS:
+        cached_ratios.clear()
+    cached_ratios[key] = value
+    return value
+
+
+def ratio(text1, text2):
+    key = (text1, text2)
+    try:
+        value = cached_ratios.get(key)
+    except TypeError:
+        # unhashable values (e.g. malformed predictions) are compared without the cache
+        return difflib.SequenceMatcher(None, text1, text2).ratio()
+    if value is None:
+        value = store_ratio(key, difflib.SequenceMatcher(None, text1, text2).ratio())
+    return value
+
+
+@lru_cache(maxsize=1 << 16)
+def character_counts(text):
+    return Counter(text)
+
+
+# Upper bound of ratio(text1, text2), computed with the same formula as SequenceMatcher (2.0 * matches / total length),
+# so that upper_bound(text1, text2) <= x implies ratio(text1, text2) <= x exactly.
+def upper_bound(text1, text2):
+    length = len(text1) + len(text2)
+    if length == 0:
+        return 1.0
+    # real_quick_ratio: the number of matches is at most the length of the shorter text
+    bound = 2.0 * min(len(text1), len(text2)) / length
+    if bound == 0:
+        return bound
+    # quick_ratio: the number of matches is at most the number of shared characters
+    try:
+        shared = character_counts(text1) & character_counts(text2)
+    except TypeError:
+        return bound
+    return min(bound, 2.0 * sum(shared.values()) / length)
+
+
+# Returns the ratio if it can be above the threshold, and None if the bounds already show it can't
+def ratio_above(text1, text2, threshold):
+    if upper_bound(text1, text2) <= threshold:
+        return None
+    return ratio(text1, text2)
+
+
+# Scores every text of texts1 against text2 (the same values as ratio(text1, text2) for each text1)
+def batch_ratios(texts1, text2):
+    matcher = None
+    scores = []
+    for text1 in texts1:
+        key = (text1, text2)
+        try:
+            value = cached_ratios.get(key)
+        except TypeError:
+            # unhashable values (e.g. malformed predictions) are compared without the cache, as in ratio()
+            scores.append(difflib.SequenceMatcher(None, text1, text2).ratio())
+            continue
+        if value is None:
+            if matcher is None:
+                # SequenceMatcher indexes its second sequence, so the index of text2 is built once for the whole batch
+                matcher = difflib.SequenceMatcher(None, None, text2)
+            matcher.set_seq1(text1)
+            value = store_ratio(key, matcher.ratio())
+        scores.append(value)
+    return scores
@@ -0,0 +1,30 @@
+import csv
+from collections import namedtuple
+
+"""
+This program reads the input csv files row by row, so that the extraction can start on the first row while the rest of the file is still being read, and memory stays flat for large inputs. Each row is yielded as a Record with its text and its label vector (a list of ints).
+"""
+
+Record = namedtuple('Record', ['text', 'labels'])
+
+
+def iter_csv(input_path):
+    with open(input_path, 'r', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for row in csvreader:
+            # the labels are 0/1 cells, int() is enough (no need to evaluate them)
+            yield Record(row[0], [int(i) for i in row[1:]])
+
+
+# Groups any iterable into lists of at most chunk_size items
+def chunked(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+